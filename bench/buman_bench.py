@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+# This benchmark is a part of buman
+#
+# Copyright (C) 2018, Slava <freeprogs.feedback@yandex.ru>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of buman on synthetic file trees and configs.
+
+Results are printed as JSON, two results can be compared with
+--compare OLD NEW.
+
+"""
+
+import sys
+import argparse
+import time
+import os
+import json
+import random
+import shutil
+import hashlib
+import tempfile
+import platform
+import subprocess
+import statistics
+import importlib.util
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.dirname(BENCH_DIR)
+SCRIPT = os.path.join(SOURCE_DIR, 'src_template', 'buman.py')
+
+MB = 1024 * 1024
+
+
+def load_module(path):
+    """."""
+    spec = importlib.util.spec_from_file_location('buman', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TreeGenerator:
+    """."""
+
+    BLOCK_SIZE = 1 * MB
+
+    def __init__(self, root, seed):
+        self.root = root
+        self.random = random.Random(seed)
+        self.block = self.random.getrandbits(
+            self.BLOCK_SIZE * 8).to_bytes(self.BLOCK_SIZE, 'little')
+
+    def make_tiny(self, count, maxsize=4096, perdir=100):
+        """."""
+        path = os.path.join(self.root, 'tiny')
+        nbytes = 0
+        for i in range(count):
+            dirname = os.path.join(path, 'd{:04d}'.format(i // perdir))
+            if i % perdir == 0:
+                os.makedirs(dirname)
+            size = self.random.randint(0, maxsize)
+            offset = self.random.randint(0, self.BLOCK_SIZE - size)
+            with open(os.path.join(dirname, 'f{:06d}'.format(i)), 'wb') as f:
+                f.write(self.block[offset:offset + size])
+            nbytes += size
+        return (path, count, nbytes)
+
+    def make_huge(self, count, size):
+        """."""
+        path = os.path.join(self.root, 'huge')
+        os.makedirs(path)
+        for i in range(count):
+            self.write_file(os.path.join(path, 'h{:02d}'.format(i)), size)
+        return (path, count, count * size)
+
+    def make_sparse(self, size, step=8 * MB, data=64 * 1024):
+        """."""
+        path = os.path.join(self.root, 'sparse')
+        os.makedirs(path)
+        filename = os.path.join(path, 's00')
+        with open(filename, 'wb') as f:
+            for offset in range(0, size, step):
+                f.seek(offset)
+                f.write(self.block[:min(data, size - offset)])
+            f.truncate(size)
+        return (path, 1, size)
+
+    def write_file(self, filename, size):
+        """."""
+        with open(filename, 'wb') as f:
+            written = 0
+            counter = 0
+            while written < size:
+                chunk = min(self.BLOCK_SIZE, size - written)
+                f.write(counter.to_bytes(8, 'little'))
+                f.write(self.block[8:chunk])
+                written += chunk
+                counter += 1
+
+
+class ConfigGenerator:
+    """."""
+
+    OPTIONS = ('copy=replace', 'copy=skip:hash=md5',
+               'copy=rotate,count=3', 'hash=sha256,verify',
+               'copy=replace:log=level=info')
+
+    def make_config(self, filename, count, src, dst):
+        """."""
+        with open(filename, 'w', encoding='utf-8') as f:
+            for i in range(count):
+                f.write('{\n')
+                f.write('    # record {}\n'.format(i))
+                f.write('    name=Record {}\n'.format(i))
+                f.write('    src={}/f{:06d}\n'.format(src, i))
+                f.write('    dst={}/a{:06d}\n'.format(dst, i))
+                f.write('    dst={}/b{:06d}\n'.format(dst, i))
+                f.write('    opt={}\n'.format(
+                    self.OPTIONS[i % len(self.OPTIONS)]))
+                f.write('}\n')
+        return filename
+
+    def make_run_config(self, filename, sources, dst):
+        """."""
+        with open(filename, 'w', encoding='utf-8') as f:
+            for i, src in enumerate(sources):
+                f.write('{\n')
+                f.write('    name=Run {}\n'.format(i))
+                f.write('    src={}\n'.format(src))
+                f.write('    dst={}\n'.format(dst))
+                f.write('    opt=copy=replace:hash=md5\n')
+                f.write('}\n')
+        return filename
+
+
+class Benchmark:
+    """."""
+
+    NAMES = ('parse', 'expand', 'copy_huge', 'copy_sparse', 'copy_tiny',
+             'hash_md5', 'hash_sha256', 'end_to_end')
+
+    def __init__(self, module, workdir, args):
+        self.m = module
+        self.workdir = workdir
+        self.args = args
+        self.data = {}
+
+    def prepare(self, names):
+        """."""
+        scale = self.args.scale
+        generator = TreeGenerator(
+            os.path.join(self.workdir, 'src'), self.args.seed)
+        if {'copy_tiny', 'end_to_end'} & set(names):
+            self.data['tiny'] = generator.make_tiny(int(5000 * scale))
+        if {'copy_huge', 'hash_md5', 'hash_sha256',
+                'end_to_end'} & set(names):
+            self.data['huge'] = generator.make_huge(
+                2, max(1, int(64 * scale)) * MB)
+        if 'copy_sparse' in names:
+            self.data['sparse'] = generator.make_sparse(
+                max(1, int(256 * scale)) * MB)
+        if {'parse', 'expand'} & set(names):
+            self.data['config'] = ConfigGenerator().make_config(
+                os.path.join(self.workdir, 'big.conf'),
+                int(20000 * scale), '/nonexistent/src', '/nonexistent/dst')
+        if 'expand' in names:
+            configuration = self.m.Configuration()
+            configuration.load_from_file(self.data['config'])
+            self.data['records'] = configuration.get_records()
+
+    def run(self, names):
+        """."""
+        out = []
+        for name in names:
+            timings, nbytes, items = self.measure(getattr(self, name))
+            out.append(self.make_result(name, timings, nbytes, items))
+        return out
+
+    def measure(self, function):
+        """."""
+        timings = []
+        nbytes = items = 0
+        for i in range(self.args.repeat):
+            self.clean_output()
+            begin = time.perf_counter()
+            nbytes, items = function()
+            timings.append(time.perf_counter() - begin)
+        self.clean_output()
+        return (timings, nbytes, items)
+
+    def make_result(self, name, timings, nbytes, items):
+        """."""
+        best = min(timings)
+        out = {
+            'name': name,
+            'repeat': len(timings),
+            'seconds_min': round(best, 6),
+            'seconds_median': round(statistics.median(timings), 6),
+            'bytes': nbytes,
+            'items': items,
+            'mb_per_s': round(nbytes / best / MB, 2) if best > 0 else 0.0,
+            'items_per_s': round(items / best, 2) if best > 0 else 0.0
+        }
+        return out
+
+    def clean_output(self):
+        """."""
+        path = os.path.join(self.workdir, 'dst')
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    def parse(self):
+        """."""
+        configuration = self.m.Configuration()
+        configuration.load_from_file(self.data['config'])
+        records = configuration.get_records()
+        return (os.path.getsize(self.data['config']), len(records))
+
+    def expand(self):
+        """."""
+        tasks_queue = self.m.TasksQueue()
+        for record in self.data['records']:
+            tasks_queue.add_record(record)
+        items = sum(1 for task in tasks_queue.iterate())
+        return (os.path.getsize(self.data['config']), items)
+
+    def copy_huge(self):
+        """."""
+        return self.copy_files(self.data['huge'][0])
+
+    def copy_sparse(self):
+        """."""
+        return self.copy_files(self.data['sparse'][0])
+
+    def copy_files(self, path):
+        """."""
+        engine = self.m.CopyEngine()
+        nbytes = items = 0
+        for name in sorted(os.listdir(path)):
+            nbytes += engine.copy_file(
+                os.path.join(path, name),
+                os.path.join(self.workdir, 'dst', name))
+            items += 1
+        return (nbytes, items)
+
+    def copy_tiny(self):
+        """."""
+        task = self.m.Task()
+        task.name = 'tiny'
+        task.source = self.data['tiny'][0]
+        task.destination = os.path.join(self.workdir, 'dst')
+        sysoperations = self.m.SystemOperations()
+        status, report = sysoperations.execute_task(task)
+        if status != sysoperations.STATUS_OK:
+            raise RuntimeError('copy_tiny failed: ' + str(report.status))
+        return (self.data['tiny'][2], self.data['tiny'][1])
+
+    def hash_md5(self):
+        """."""
+        return self.hash_files(hashlib.md5)
+
+    def hash_sha256(self):
+        """."""
+        return self.hash_files(hashlib.sha256)
+
+    def hash_files(self, algo):
+        """."""
+        hasher = self.m.Hasher()
+        path = self.data['huge'][0]
+        nbytes = items = 0
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            (code, msg), text = hasher.hash_digest_file(filename, algo())
+            if code != 0:
+                raise RuntimeError(msg)
+            nbytes += os.path.getsize(filename)
+            items += 1
+        return (nbytes, items)
+
+    def end_to_end(self):
+        """."""
+        config = ConfigGenerator().make_run_config(
+            os.path.join(self.workdir, 'run.conf'),
+            [self.data['tiny'][0], self.data['huge'][0]],
+            os.path.join(self.workdir, 'dst'))
+        logfile = os.path.join(self.workdir, 'run.log')
+        for suffix in ('.hashcache', '.plancache', '.journal'):
+            if os.path.exists(os.path.splitext(logfile)[0] + suffix):
+                os.unlink(os.path.splitext(logfile)[0] + suffix)
+        subprocess.run(
+            [sys.executable, SCRIPT, '--config', config,
+             '--logfile', logfile, '--jobs', str(self.args.jobs)],
+            stdout=subprocess.DEVNULL, check=True)
+        nbytes = self.data['tiny'][2] + self.data['huge'][2]
+        items = self.data['tiny'][1] + self.data['huge'][1]
+        return (nbytes, items)
+
+
+def get_commit():
+    """."""
+    try:
+        out = subprocess.run(
+            ['git', '-C', SOURCE_DIR, 'rev-parse', '--short', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except OSError:
+        out = ''
+    return out or None
+
+
+def compare(oldname, newname):
+    """."""
+    with open(oldname, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(newname, encoding='utf-8') as f:
+        new = json.load(f)
+    oldresults = {i['name']: i for i in old['results']}
+    print('{:<14} {:>12} {:>12} {:>8}'.format(
+        'benchmark', old.get('commit') or 'old',
+        new.get('commit') or 'new', 'speedup'))
+    for result in new['results']:
+        before = oldresults.get(result['name'])
+        if before is None:
+            continue
+        after = result['seconds_min']
+        ratio = before['seconds_min'] / after if after > 0 else 0.0
+        print('{:<14} {:>12.4f} {:>12.4f} {:>7.2f}x'.format(
+            result['name'], before['seconds_min'], after, ratio))
+
+
+def get_arguments():
+    """."""
+    parser = argparse.ArgumentParser(
+        description='Run benchmarks of buman and print JSON results.')
+    parser.add_argument('names',
+                        nargs='*',
+                        metavar='name',
+                        help='benchmarks to run: {} (default: all)'.format(
+                            ', '.join(Benchmark.NAMES)))
+    parser.add_argument('--scale',
+                        type=float,
+                        default=1.0,
+                        help='size of the data sets (default: %(default)s)')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='runs of every benchmark (default: %(default)s)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=2018,
+                        help='seed of the data sets (default: %(default)s)')
+    parser.add_argument('--jobs', '-j',
+                        type=int,
+                        default=1,
+                        help='jobs of the end-to-end run'
+                             ' (default: %(default)s)')
+    parser.add_argument('--workdir',
+                        help='directory for the data sets'
+                             ' (default: a temporary directory)')
+    parser.add_argument('--keep',
+                        action='store_true',
+                        help='keep the data sets after the run')
+    parser.add_argument('--output', '-o',
+                        help='file for the results (default: stdout)')
+    parser.add_argument('--compare',
+                        nargs=2,
+                        metavar=('OLD', 'NEW'),
+                        help='compare two result files and exit')
+    args = parser.parse_args()
+    unknown = set(args.names) - set(Benchmark.NAMES)
+    if unknown:
+        parser.error('unknown benchmarks: ' + ', '.join(sorted(unknown)))
+    if args.repeat < 1:
+        parser.error('--repeat should be at least 1')
+    return args
+
+
+def main():
+    """."""
+    args = get_arguments()
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    names = args.names or list(Benchmark.NAMES)
+    module = load_module(SCRIPT)
+    workdir = tempfile.mkdtemp(prefix='buman-bench-', dir=args.workdir)
+    try:
+        benchmark = Benchmark(module, workdir, args)
+        begin = time.perf_counter()
+        benchmark.prepare(names)
+        prepared = time.perf_counter() - begin
+        results = benchmark.run(names)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    out = {
+        'commit': get_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': module.numpy is not None,
+        'scale': args.scale,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'prepare_seconds': round(prepared, 3),
+        'results': results
+    }
+    text = json.dumps(out, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -32,8 +32,29 @@ import argparse
 import time
 import os
 import re
-import shutil
-import subprocess
+import errno
+import hashlib
+import json
+import stat
+import zlib
+import bz2
+import tarfile
+import threading
+import queue
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import signal
+import cProfile
+import pstats
+import tracemalloc
+import io
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class ConfigFileNotFound(Exception):
@@ -62,11 +83,14 @@ class Application:
     def run(self):
         """."""
         controller = Controller()
-        controller.get_arguments()
-        controller.get_configuration()
-        controller.make_tasks()
-        controller.process_tasks()
-        controller.finalize()
+        try:
+            controller.get_arguments()
+            controller.get_configuration()
+            controller.make_tasks()
+            controller.process_tasks()
+            controller.finalize()
+        finally:
+            controller.close()
 
 
 class Controller:
@@ -78,12 +102,20 @@ class Controller:
         self.tasks_queue = TasksQueue()
         self.console = Console()
         self.logger = Logger()
+        self.hash_cache = HashCache()
+        self.plan_cache = PlanCache()
+        self.report_file = ReportFile()
+        self.journal = TaskJournal()
+        self.profiler = Profiler()
+        self.process_pool = ProcessPool()
 
     def get_arguments(self):
         """."""
         self.args.load_from_cmdline()
         consolemessages = ConsoleMessages()
         self.console.print_message(consolemessages.get_progname())
+        if self.args.get_argument('profile') is not None:
+            self.profiler.start()
 
     def get_configuration(self):
         """."""
@@ -91,76 +123,306 @@ class Controller:
         configchecker = ConfigFileChecker()
         filename = self.args.get_argument('config')
         logfile = self.args.get_argument('logfile')
+        hashcache = self.get_hashcache_filename()
         self.console.print_message(
             consolemessages.get_logfile(logfile))
+        self.console.print_message(
+            consolemessages.get_hashcache(hashcache))
+        self.hash_cache.load(hashcache, self.args.get_argument('rehash'))
+        reportfile = self.args.get_argument('report')
+        dry_run = self.args.get_argument('dry_run')
+        if reportfile is not None:
+            self.console.print_message(
+                consolemessages.get_reportfile(reportfile))
+            if not dry_run:
+                self.report_file.open(reportfile)
+        journal = self.get_journal_filename()
+        self.console.print_message(
+            consolemessages.get_journal(journal))
+        if not dry_run:
+            self.journal.open(journal, self.args.get_argument('resume'))
         self.console.print_message(
             consolemessages.get_configuration(filename))
         if not configchecker.exists(filename):
             self.console.print_message(
                 consolemessages.get_config_nofile())
             raise ConfigFileNotFound
-        if configchecker.is_empty(filename):
+        plancache = self.get_plancache_filename()
+        self.console.print_message(
+            consolemessages.get_plancache(plancache))
+        if self.plan_cache.load(
+                plancache, filename, self.args.get_argument('replan')):
+            self.console.print_message(
+                consolemessages.get_plancache_loaded())
+            return
+        try:
+            self.config.load_from_file(filename)
+        except ConfigFileEmpty:
             self.console.print_message(
                 consolemessages.get_config_empty())
-            raise ConfigFileEmpty
-        if not configchecker.is_correct(filename):
+            raise
+        except ConfigFileSyntax as e:
             self.console.print_message(
-                consolemessages.get_config_syntax())
-            raise ConfigFileSyntax
-        self.config.load_from_file(filename)
+                consolemessages.get_config_syntax(*e.args))
+            raise
+
+    def get_hashcache_filename(self):
+        """."""
+        filename = self.args.get_argument('hashcache')
+        if filename is None:
+            logfile = self.args.get_argument('logfile')
+            filename = os.path.splitext(logfile)[0] + '.hashcache'
+        return filename
+
+    def get_plancache_filename(self):
+        """."""
+        filename = self.args.get_argument('plancache')
+        if filename is None:
+            logfile = self.args.get_argument('logfile')
+            filename = os.path.splitext(logfile)[0] + '.plancache'
+        return filename
+
+    def get_journal_filename(self):
+        """."""
+        filename = self.args.get_argument('journal')
+        if filename is None:
+            logfile = self.args.get_argument('logfile')
+            filename = os.path.splitext(logfile)[0] + '.journal'
+        return filename
 
     def make_tasks(self):
         """."""
-        converter = RecordConverter()
-        for record in self.config.get_records():
-            for task in converter.record_to_tasks(record):
-                self.tasks_queue.add_task(task)
+        records = self.plan_cache.get_records()
+        if records is None:
+            records = self.config.get_records()
+            if not self.args.get_argument('dry_run'):
+                self.plan_cache.save(records)
+        for record in records:
+            self.tasks_queue.add_record(record)
+        mode = self.args.get_argument('schedule')
+        if mode != TaskScheduler.CONFIG:
+            self.console.print_message(
+                ConsoleMessages().get_schedule(mode))
+            self.tasks_queue.reorder(TaskScheduler(mode))
 
     def process_tasks(self):
         """."""
-        logconfigurator = LogConfigurator()
-        sysoperations = SystemOperations()
+        sysoperations = SystemOperations(
+            self.hash_cache, self.process_pool)
         consolemessages = ConsoleMessages()
-        repconverter = ReportConverter()
-        logconf_default = LogConfig(
-            self.args.get_argument('logfile'), Logger.LEVEL_ERROR)
-        taskn_total = self.tasks_queue.length()
-        taskn_success = taskn_skipped = taskn_failed = 0
-        taskn_cur = 0
+        counter = TasksCounter()
+        jobs = self.args.get_argument('jobs')
 
         self.console.print_message(
             consolemessages.get_header(
                 self.args.get_argument('config'),
                 self.args.get_argument('logfile')))
-        for task in self.tasks_queue.iterate():
+        if self.args.get_argument('dry_run'):
+            self.plan_tasks(jobs)
+            return
+        if jobs > 1:
+            self.process_tasks_parallel(sysoperations, counter, jobs)
+        else:
+            self.process_tasks_serial(sysoperations, counter)
+        if counter.resumed:
+            self.console.print_message(
+                consolemessages.get_resumed(counter.resumed))
+        self.console.print_message(
+            consolemessages.get_footer(
+                self.tasks_queue.length(),
+                counter.success, counter.skipped, counter.failed))
+
+    def process_tasks_serial(self, sysoperations, counter):
+        """."""
+        consolemessages = ConsoleMessages()
+        taskn_total = self.tasks_queue.length()
+        taskn_cur = 0
+
+        try:
+            for group in self.iterate_groups(counter):
+                if len(group) == 1:
+                    task = group[0]
+                    taskn_cur += 1
+                    self.console.print_message(
+                        consolemessages.get_task_left(
+                            task.name, taskn_cur, taskn_total),
+                        with_newline=False)
+                    status, report = sysoperations.execute_task(task)
+                    self.finish_task(task, status, report, counter)
+                else:
+                    results = sysoperations.execute_tasks(group)
+                    taskn_cur = self.finish_group(
+                        group, results, taskn_cur, taskn_total, counter)
+        except KeyboardInterrupt:
+            sysoperations.interrupt()
+            raise
+
+    def process_tasks_parallel(self, sysoperations, counter, jobs):
+        """."""
+        limiter = DeviceLimiter(self.args.get_argument('jobs_per_device'))
+        executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        taskn_total = self.tasks_queue.length()
+        taskn_cur = 0
+        pending = collections.deque()
+
+        try:
+            for group in self.iterate_groups(counter):
+                if len(pending) >= jobs * 4:
+                    group_done, future = pending.popleft()
+                    taskn_cur = self.finish_group(
+                        group_done, future.result(),
+                        taskn_cur, taskn_total, counter)
+                future = executor.submit(
+                    limiter.execute, sysoperations, group)
+                pending.append((group, future))
+            while pending:
+                group_done, future = pending.popleft()
+                taskn_cur = self.finish_group(
+                    group_done, future.result(),
+                    taskn_cur, taskn_total, counter)
+        except KeyboardInterrupt:
+            sysoperations.interrupt()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iterate_groups(self, counter):
+        """."""
+        resume = self.args.get_argument('resume')
+        for group in self.tasks_queue.iterate_groups():
+            pending = []
+            for task in group:
+                if resume and self.journal.is_done(task):
+                    counter.resume()
+                else:
+                    pending.append(task)
+            if pending:
+                yield pending
+
+    def plan_tasks(self, jobs):
+        """."""
+        consolemessages = ConsoleMessages()
+        planner = DryRunPlanner()
+        totals = DryRunTotals()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            DryRunPlanner.WORKERS)
+        taskn_total = self.tasks_queue.length()
+        taskn_cur = 0
+        pending = collections.deque()
+
+        try:
+            for task in self.tasks_queue.iterate():
+                if len(pending) >= DryRunPlanner.WORKERS * 4:
+                    taskn_cur += 1
+                    self.finish_plan(
+                        pending.popleft(), taskn_cur, taskn_total, totals)
+                pending.append((task, executor.submit(planner.plan, task)))
+            while pending:
+                taskn_cur += 1
+                self.finish_plan(
+                    pending.popleft(), taskn_cur, taskn_total, totals)
+        except KeyboardInterrupt:
+            for task, future in pending:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+        history = ThroughputHistory()
+        reportfile = self.args.get_argument('report')
+        if reportfile is not None:
+            history.load(reportfile)
+        self.console.print_message(
+            consolemessages.get_plan_footer(totals, history, jobs))
+
+    def finish_plan(self, item, taskn_cur, taskn_total, totals):
+        """."""
+        consolemessages = ConsoleMessages()
+        task, future = item
+        action, nread, nwrite = future.result()
+        totals.add(action, nread, nwrite)
+        self.console.print_message(
+            consolemessages.get_plan_task(
+                task.name, taskn_cur, taskn_total, action, nread, nwrite))
+
+    def finish_group(self, group, results, taskn_cur, taskn_total, counter):
+        """."""
+        consolemessages = ConsoleMessages()
+        for task, (status, report) in zip(group, results):
             taskn_cur += 1
-            self.logger.set_config(
-                logconfigurator.get_config_from_task(task, logconf_default))
             self.console.print_message(
                 consolemessages.get_task_left(
-                    task.name, taskn_cur, taskn_total),
+                    task.name, taskn_cur, taskn_total, task.begin),
                 with_newline=False)
-            status, report = sysoperations.execute_task(task)
-            self.console.print_message(consolemessages.get_task_right(status))
-            if status == SystemOperations.STATUS_OK:
-                taskn_success += 1
-                self.logger.log_message(
-                    repconverter.to_log_message(report), Logger.LEVEL_INFO)
-            elif status == SystemOperations.STATUS_SKIPPED:
-                taskn_skipped += 1
-            elif status == SystemOperations.STATUS_FAILED:
-                taskn_failed += 1
-                self.logger.log_message(
-                    repconverter.to_log_message(report), Logger.LEVEL_ERROR)
-            elif status == SystemOperations.STATUS_CTRLC:
-                raise KeyboardInterrupt
-            self.console.print_message(repconverter.to_console_message(report))
-        self.console.print_message(
-            consolemessages.get_footer(
-                taskn_total, taskn_success, taskn_skipped, taskn_failed))
+            self.finish_task(task, status, report, counter)
+        return taskn_cur
+
+    def finish_task(self, task, status, report, counter):
+        """."""
+        logconfigurator = LogConfigurator()
+        consolemessages = ConsoleMessages()
+        repconverter = ReportConverter()
+        logconf_default = LogConfig(
+            self.args.get_argument('logfile'), Logger.LEVEL_ERROR)
+
+        self.logger.set_config(
+            logconfigurator.get_config_from_task(task, logconf_default))
+        self.console.print_message(consolemessages.get_task_right(status))
+        counter.count(status)
+        if status in (SystemOperations.STATUS_OK,
+                      SystemOperations.STATUS_SKIPPED):
+            self.journal.add(task)
+        if status == SystemOperations.STATUS_OK:
+            self.logger.log_message(
+                repconverter.to_log_message(report), Logger.LEVEL_INFO)
+        elif status == SystemOperations.STATUS_FAILED:
+            self.logger.log_message(
+                repconverter.to_log_message(report), Logger.LEVEL_ERROR)
+        elif status == SystemOperations.STATUS_CTRLC:
+            raise KeyboardInterrupt
+        self.console.print_message(repconverter.to_console_message(report))
+        if self.report_file.is_open():
+            self.report_file.write(repconverter.to_json_message(
+                report, consolemessages.get_task_right(status)))
 
     def finalize(self):
         """."""
+        self.logger.flush()
+        self.report_file.flush()
+        self.journal.sync()
+        profile = self.args.get_argument('profile')
+        if self.profiler.is_running():
+            self.profiler.stop()
+            self.profiler.save(profile)
+            self.console.print_message(
+                ConsoleMessages().get_profile(
+                    profile, self.profiler.peak))
+
+    def close(self):
+        """."""
+        self.save_hash_cache()
+        self.process_pool.close()
+        self.logger.close()
+        self.report_file.close()
+        self.journal.close()
+        if self.profiler.is_running():
+            self.profiler.stop()
+
+    def save_hash_cache(self):
+        """."""
+        if not self.hash_cache.is_loaded():
+            return
+        if self.args.get_argument('dry_run'):
+            return
+        try:
+            self.hash_cache.save()
+        except OSError as e:
+            self.console.print_message(
+                ConsoleMessages().get_hashcache_error(
+                    e.filename, e.strerror))
+        except Exception as e:
+            self.console.print_message(
+                ConsoleMessages().get_hashcache_error(
+                    self.hash_cache.filename, str(e)))
 
 
 class Arguments:
@@ -197,6 +459,55 @@ class CommandLineArguments:
         parser.add_argument('--logfile',
                             default=self.default_logfile,
                             help='file for logging (default: %(default)s)')
+        parser.add_argument('--hashcache',
+                            help='file for caching hashes of unchanged files'
+                                 ' (default: near the logging file)')
+        parser.add_argument('--rehash',
+                            action='store_true',
+                            help='hash all files again, ignore hash cache')
+        parser.add_argument('--plancache',
+                            help='file for caching tasks of unchanged config'
+                                 ' (default: near the logging file)')
+        parser.add_argument('--replan',
+                            action='store_true',
+                            help='parse the config again, ignore plan cache')
+        parser.add_argument('--journal',
+                            help='file for the journal of done tasks'
+                                 ' (default: near the logging file)')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            help='skip tasks done by the previous run'
+                                 ' according to the journal')
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            help='show what would be done and estimate'
+                                 ' bytes and time without copying')
+        parser.add_argument('--jobs', '-j',
+                            type=int,
+                            default=1,
+                            help='number of tasks running at the same time'
+                                 ' (default: %(default)s)')
+        parser.add_argument('--jobs-per-device',
+                            type=int,
+                            default=0,
+                            help='number of tasks writing to the same'
+                                 ' device at the same time'
+                                 ' (default: no limit)')
+        parser.add_argument('--schedule',
+                            choices=TaskScheduler.MODES,
+                            default=TaskScheduler.CONFIG,
+                            help='order of tasks: as in config, largest'
+                                 ' first, largest first spread over'
+                                 ' devices or grouped by devices'
+                                 ' (default: %(default)s)')
+        parser.add_argument('--report',
+                            help='file for the report of tasks'
+                                 ' in JSON lines (default: no report)')
+        parser.add_argument('--profile',
+                            metavar='FILE',
+                            help='profile the run and write the hot spots'
+                                 ' and the peak memory to the file'
+                                 ' (default: no profile)')
         parser.add_argument('--version', '-V',
                             action='version',
                             version='%(prog)s ' + 'v' + __version__)
@@ -218,7 +529,8 @@ class Configuration:
 
     def load_from_file(self, filename):
         """."""
-        config_file = ConfigFile(filename, FileReader(), RecordParser())
+        config_file = ConfigFile(
+            filename, ConfigCheckTokenizer(), ConfigRecognizer())
         self.records = config_file.load_records()
 
     def get_records(self):
@@ -234,184 +546,346 @@ class ConfigFileChecker:
         out = os.path.exists(filename)
         return out
 
-    def is_empty(self, filename):
-        """."""
-        with open(filename, encoding='utf-8') as fin:
-            result = fin.read().strip()
-        return result == ''
-
-    def is_correct(self, filename):
-        """."""
-        with open(filename, encoding='utf-8') as fin:
-            text = fin.read()
-        cleared = text.strip()
-        out = re.search(r'^\{.*\}$',
-                        cleared,
-                        flags=re.DOTALL) is not None
-        return out
-
 
 class ConfigCheckTokenizer:
     """."""
 
-    def tokenize(self, text):
+    def tokenize(self, lines):
         """."""
+        for lineno, line in enumerate(lines, 1):
+            text = line.strip()
+            if not text:
+                continue
+            token = ConfigCheckToken()
+            token.line = lineno
+            if text == '{':
+                token.type = ConfigCheckToken.OPEN
+            elif text == '}':
+                token.type = ConfigCheckToken.CLOSE
+            elif text[0] == '#':
+                token.type = ConfigCheckToken.COMMENT
+            else:
+                key, sep, value = text.partition('=')
+                token.value = value
+                if not sep:
+                    token.type = ConfigCheckToken.UNKNOWN
+                    token.value = text
+                elif key == 'src':
+                    token.type = ConfigCheckToken.SRC
+                elif key == 'dst':
+                    token.type = ConfigCheckToken.DST
+                elif key == 'opt':
+                    token.type = ConfigCheckToken.OPT
+                elif key == 'name':
+                    token.type = ConfigCheckToken.NAME
+                else:
+                    token.type = ConfigCheckToken.UNKNOWN
+                    token.value = text
+            yield token
 
 
 class ConfigCheckToken:
     """."""
 
+    OPEN = 1
+    CLOSE = 2
+    COMMENT = 3
+    NAME = 4
+    SRC = 5
+    DST = 6
+    OPT = 7
+    UNKNOWN = 8
+
     def __init__(self):
         self.type = None
         self.value = None
+        self.line = None
 
 
 class ConfigFile:
     """."""
 
-    def __init__(self, filename, reader, parser):
+    def __init__(self, filename, tokenizer, recognizer):
         self.filename = filename
-        self.reader = reader
-        self.parser = parser
+        self.tokenizer = tokenizer
+        self.recognizer = recognizer
 
     def load_records(self):
         """."""
-        out = []
         with open(self.filename, encoding='utf-8') as fin:
-            while True:
-                block = self.reader.read_block(fin)
-                if not block:
-                    break
-                record = self.parser.from_string(block)
-                out.append(record)
+            tokens = self.tokenizer.tokenize(fin)
+            out = list(self.recognizer.recognize(tokens))
+        if not out:
+            raise ConfigFileEmpty
         return out
 
 
-class FileReader:
+class ConfigParseTokenizer:
     """."""
 
-    def read_block(self, ifp):
+    HASH_ALGOS = ('md5', 'sha1', 'sha256', 'blake2b', 'blake2s')
+    COPY_MODES = ('error', 'skip', 'replace', 'rotate', 'link', 'delta')
+    ARCH_ALGOS = ('tar', 'bz2')
+    CIPHER_ALGOS = ('xor', 'aes')
+    LOG_LEVELS = ('info', 'warning', 'error')
+    DEFAULTS = {
+        'hash': {'algo': 'md5'},
+        'copy': {'mode': 'replace'},
+        'arch': {'algo': 'tar'},
+        'cipher': {'algo': 'xor'},
+        'log': {}
+    }
+
+    def parse_option(self, optvalue):
         """."""
-        block_lines = []
-        for line in ifp:
-            block_lines.append(line)
-            if line.strip() == '}':
-                break
-        out = ''.join(block_lines).strip()
+        name, sep, valuelist = optvalue.partition('=')
+        values = self.split_values(valuelist, ',') if sep else []
+        if name == 'hash':
+            params = {}
+            for value in values:
+                if value == 'verify':
+                    params['verify'] = True
+                elif value in self.HASH_ALGOS:
+                    params['algo'] = value
+            out = ('hash', params)
+        elif name == 'copy':
+            params = {}
+            for value in values:
+                if value in self.COPY_MODES:
+                    params['mode'] = value
+                elif value.startswith('count=') and value[6:].isdigit():
+                    params['count'] = int(value[6:])
+                elif value.startswith('workers=') and value[8:].isdigit():
+                    params['workers'] = int(value[8:])
+                elif value.startswith('prev=<') and value.endswith('>'):
+                    params['prev'] = value[6:-1]
+                elif value.startswith('min=') and value[4:].isdigit():
+                    params['min'] = int(value[4:])
+            out = ('copy', params)
+        elif name == 'arch':
+            params = {}
+            for value in values:
+                if value in self.ARCH_ALGOS:
+                    params['algo'] = value
+                elif value.startswith('workers=') and value[8:].isdigit():
+                    params['workers'] = int(value[8:])
+            out = ('arch', params)
+        elif name == 'cipher':
+            params = {}
+            for value in values:
+                if (value.startswith('algo=')
+                        and value[5:] in self.CIPHER_ALGOS):
+                    params['algo'] = value[5:]
+                elif (value.startswith('password=<')
+                        and value.endswith('>')):
+                    params['password'] = value[10:-1]
+            out = ('cipher', params)
+        elif name == 'log':
+            params = {}
+            for value in values:
+                if value.startswith('file=<') and value.endswith('>'):
+                    params['filename'] = value[6:-1]
+                elif value.startswith('level='):
+                    params['level'] = self.get_log_level(value[6:])
+            out = ('log', params)
+        else:
+            out = None
         return out
 
+    def get_log_level(self, name):
+        """."""
+        if name == 'info':
+            out = Logger.LEVEL_INFO
+        elif name == 'warning':
+            out = Logger.LEVEL_WARNING
+        else:
+            out = Logger.LEVEL_ERROR
+        return out
 
-class RecordParser:
-    """."""
-
-    def from_string(self, s):
+    def split_values(self, text, separator):
         """."""
-        record = Record()
-        tokenizer = ConfigParseTokenizer()
-        blocks = tokenizer.text_to_blocks(s)
-        tokens = tokenizer.blocks_to_tokens(blocks)
-        for token in tokens:
-            if token.type == ConfigParseToken.NAME:
-                record.name = token.value
-            elif token.type == ConfigParseToken.SRC:
-                record.sources.append(token.value)
-            elif token.type == ConfigParseToken.DST:
-                record.destinations.append(token.value)
-            elif token.type == ConfigParseToken.OPT:
-                option = RecordOption()
-                option.name = token.value[0]
-                option.params = token.value[1]
-                record.options.append(option)
-        return record
+        if '<' not in text:
+            return text.split(separator)
+        out = []
+        start = depth = 0
+        for i, char in enumerate(text):
+            if char == '<':
+                depth += 1
+            elif char == '>' and depth > 0:
+                depth -= 1
+            elif char == separator and depth == 0:
+                out.append(text[start:i])
+                start = i + 1
+        out.append(text[start:])
+        return out
 
 
-class ConfigParseTokenizer:
+class ConfigRecognizer:
     """."""
 
-    def text_to_blocks(self, text):
-        """."""
-        for line in text.splitlines():
-            cleared_line = line.lstrip()
-            if cleared_line.startswith(
-                    ('name=', 'src=', 'dst=', 'opt=')):
-                yield cleared_line
-
-    def blocks_to_tokens(self, blocks):
-        """."""
-        for block in blocks:
-            if block.startswith('name='):
-                token = ConfigParseToken()
-                token.type = ConfigParseToken.NAME
-                token.value = block.split('=', 1)[1]
-                yield token
-            elif block.startswith('src='):
-                token = ConfigParseToken()
-                token.type = ConfigParseToken.SRC
-                token.value = block.split('=', 1)[1]
-                yield token
-            elif block.startswith('dst='):
-                token = ConfigParseToken()
-                token.type = ConfigParseToken.DST
-                token.value = block.split('=', 1)[1]
-                yield token
-            elif block.startswith('opt='):
-                token = ConfigParseToken()
-                token.type = ConfigParseToken.OPT
-                optvalue = block.split('=', 1)[1]
-                if optvalue.startswith('hash'):
-                    if '=' in optvalue:
-                        optalgo = optvalue.split('=', 1)[1]
-                    else:
-                        optalgo = 'md5'
-                    token.value = ('hash', {'algo': optalgo})
-                yield token
-
-
-class ConfigParseToken:
-    """."""
-
-    NAME = 1
-    SRC = 2
-    DST = 3
-    OPT = 4
+    OUTSIDE = 0
+    INSIDE = 1
+
+    OPTION_VALUES = {
+        'copy': re.compile(
+            '|'.join(ConfigParseTokenizer.COPY_MODES)
+            + r'|count=\d+|workers=\d+|prev=<.+>|min=\d+'),
+        'hash': re.compile(
+            '|'.join(ConfigParseTokenizer.HASH_ALGOS) + r'|verify'),
+        'arch': re.compile(
+            '|'.join(ConfigParseTokenizer.ARCH_ALGOS) + r'|workers=\d+'),
+        'log': re.compile(
+            r'file=<.+>|level=(?:'
+            + '|'.join(ConfigParseTokenizer.LOG_LEVELS) + ')'),
+        'cipher': re.compile(
+            r'algo=(?:' + '|'.join(ConfigParseTokenizer.CIPHER_ALGOS)
+            + r')|password=<.+>')
+    }
 
     def __init__(self):
-        self.type = None
-        self.value = None
+        self.parser = ConfigParseTokenizer()
+        self.options = {}
+
+    def recognize(self, tokens):
+        """."""
+        state = self.OUTSIDE
+        record = None
+        start = None
+        empty = True
+        for token in tokens:
+            if state == self.OUTSIDE:
+                if token.type != ConfigCheckToken.OPEN:
+                    raise ConfigFileSyntax(token.line, 'expected "{"')
+                record = Record()
+                start = token.line
+                empty = True
+                state = self.INSIDE
+            elif token.type == ConfigCheckToken.CLOSE:
+                if empty:
+                    raise ConfigFileSyntax(token.line, 'empty record')
+                yield record
+                state = self.OUTSIDE
+            elif token.type == ConfigCheckToken.OPEN:
+                raise ConfigFileSyntax(
+                    token.line,
+                    'expected "}}" for record at line {}'.format(start))
+            else:
+                self.add_token(record, token)
+                if token.type != ConfigCheckToken.COMMENT:
+                    empty = False
+        if state == self.INSIDE:
+            raise ConfigFileSyntax(start, 'record is not closed')
+
+    def add_token(self, record, token):
+        """."""
+        if token.type == ConfigCheckToken.UNKNOWN:
+            raise ConfigFileSyntax(
+                token.line, 'unknown line: ' + token.value)
+        if token.type == ConfigCheckToken.COMMENT:
+            return
+        if not token.value:
+            raise ConfigFileSyntax(token.line, 'empty value')
+        if token.type == ConfigCheckToken.NAME:
+            record.name = token.value
+        elif token.type == ConfigCheckToken.SRC:
+            record.sources.append(token.value)
+        elif token.type == ConfigCheckToken.DST:
+            record.destinations.append(token.value)
+        elif token.type == ConfigCheckToken.OPT:
+            if token.value not in self.options:
+                self.options[token.value] = self.make_options(token)
+            record.options.extend(self.options[token.value])
+
+    def make_options(self, token):
+        """."""
+        out = []
+        for optvalue in self.parser.split_values(token.value, ':'):
+            error = self.check_option(optvalue)
+            if error is not None:
+                raise ConfigFileSyntax(token.line, error)
+            name, params = self.parser.parse_option(optvalue)
+            option = RecordOption()
+            option.name = name
+            option.params = params
+            out.append(option)
+        return out
+
+    def check_option(self, optvalue):
+        """."""
+        name, sep, valuelist = optvalue.partition('=')
+        if name not in self.OPTION_VALUES:
+            return 'unknown option: ' + name
+        if not sep:
+            return None
+        pattern = self.OPTION_VALUES[name]
+        for value in self.parser.split_values(valuelist, ','):
+            if pattern.fullmatch(value) is None:
+                return 'incorrect value of option {}: {}'.format(name, value)
+        return None
 
 
 class RecordConverter:
     """."""
 
-    def record_to_tasks(self, record):
+    def __init__(self):
+        self.options = {}
+
+    def iterate_groups(self, record):
         """."""
-        out = []
+        options = self.record_to_options(record)
         for src in record.sources:
+            group = []
             for dst in record.destinations:
                 task = Task()
                 task.name = record.name
                 task.source = src
                 task.destination = dst
-                for opt in record.options:
-                    option = TaskOption()
-                    option.name = opt.name
-                    option.params = opt.params
-                    task.options.append(option)
-                out.append(task)
+                task.options = options
+                group.append(task)
+            yield group
+
+    def record_to_options(self, record):
+        """."""
+        key = tuple(id(opt) for opt in record.options)
+        out = self.options.get(key)
+        if out is None:
+            converter = RecordOptionConverter()
+            out = [converter.record_to_task(opt)
+                   for opt in converter.merge_options(record.options)]
+            self.options[key] = out
         return out
 
 
 class RecordOptionConverter:
     """."""
 
+    def merge_options(self, options):
+        """."""
+        merged = collections.OrderedDict()
+        for option in options:
+            merged.setdefault(option.name, {}).update(option.params)
+        out = []
+        for name, params in merged.items():
+            option = RecordOption()
+            option.name = name
+            option.params = dict(
+                ConfigParseTokenizer.DEFAULTS.get(name, {}), **params)
+            out.append(option)
+        return out
+
     def record_to_task(self, option):
         """."""
-        return TaskOption()
+        out = TaskOption()
+        out.name = option.name
+        out.params = option.params
+        return out
 
 
 class Record:
     """."""
 
+    __slots__ = ('name', 'sources', 'destinations', 'options')
+
     def __init__(self):
         self.name = None
         self.sources = []
@@ -422,6 +896,8 @@ class Record:
 class RecordOption:
     """."""
 
+    __slots__ = ('name', 'params')
+
     def __init__(self):
         self.name = None
         self.params = {}
@@ -430,16 +906,30 @@ class RecordOption:
 class Task:
     """."""
 
+    __slots__ = ('name', 'source', 'destination', 'options',
+                 'begin', 'end', 'status', 'nbytes', 'nwritten', 'stages',
+                 'phases', 'fingerprint')
+
     def __init__(self):
         self.name = None
         self.source = None
         self.destination = None
         self.options = []
+        self.begin = None
+        self.end = None
+        self.status = None
+        self.nbytes = 0
+        self.nwritten = 0
+        self.stages = ()
+        self.phases = ()
+        self.fingerprint = None
 
 
 class TaskOption:
     """."""
 
+    __slots__ = ('name', 'params')
+
     def __init__(self):
         self.name = None
         self.params = {}
@@ -449,19 +939,289 @@ class TasksQueue:
     """."""
 
     def __init__(self):
-        self.tasks = []
+        self.items = []
+        self.count = 0
 
-    def add_task(self, task):
+    def add_record(self, record):
         """."""
-        self.tasks.append(task)
+        self.items.append(record)
+        self.count += len(record.sources) * len(record.destinations)
+
+    def reorder(self, scheduler):
+        """."""
+        self.items = scheduler.order(list(self.iterate_groups()))
 
     def iterate(self):
         """."""
-        return iter(self.tasks)
+        for group in self.iterate_groups():
+            for task in group:
+                yield task
+
+    def iterate_groups(self):
+        """."""
+        converter = RecordConverter()
+        for item in self.items:
+            if isinstance(item, Record):
+                for group in converter.iterate_groups(item):
+                    yield group
+            else:
+                yield item
 
     def length(self):
         """."""
-        return len(self.tasks)
+        return self.count
+
+
+class TaskScheduler:
+    """."""
+
+    CONFIG = 'config'
+    SIZE = 'size'
+    SPREAD = 'spread'
+    GROUP = 'group'
+    MODES = (CONFIG, SIZE, SPREAD, GROUP)
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.sizes = {}
+
+    def order(self, groups):
+        """."""
+        if self.mode == self.CONFIG:
+            return groups
+        items = [(self.get_work(group), self.get_devices(group), group)
+                 for group in groups]
+        items.sort(key=lambda item: item[0], reverse=True)
+        if self.mode == self.SPREAD:
+            out = self.spread(items)
+        elif self.mode == self.GROUP:
+            items.sort(key=lambda item: item[1])
+            out = [group for work, devices, group in items]
+        else:
+            out = [group for work, devices, group in items]
+        return out
+
+    def spread(self, items):
+        """."""
+        buckets = collections.OrderedDict()
+        for work, devices, group in items:
+            buckets.setdefault(devices, collections.deque()).append(
+                (work, group))
+        out = []
+        while buckets:
+            keys = sorted(buckets, key=lambda k: buckets[k][0][0],
+                          reverse=True)
+            for key in keys:
+                work, group = buckets[key].popleft()
+                out.append(group)
+                if not buckets[key]:
+                    del buckets[key]
+        return out
+
+    def get_work(self, group):
+        """."""
+        return self.get_size(group[0].source) * len(group)
+
+    def get_devices(self, group):
+        """."""
+        src = self.get_device(group[0].source)
+        dsts = tuple(sorted(set(
+            self.get_device(task.destination) for task in group)))
+        return (src, dsts)
+
+    def get_device(self, path):
+        """."""
+        try:
+            out = os.stat(path).st_dev
+        except OSError:
+            try:
+                out = os.stat(os.path.dirname(path) or '.').st_dev
+            except OSError:
+                out = -1
+        return out
+
+    def get_size(self, path):
+        """."""
+        if path in self.sizes:
+            return self.sizes[path]
+        try:
+            st = os.stat(path)
+        except OSError:
+            out = 0
+        else:
+            if stat.S_ISDIR(st.st_mode):
+                out = self.get_tree_size(path)
+            else:
+                out = st.st_size
+        self.sizes[path] = out
+        return out
+
+    def get_tree_size(self, path):
+        """."""
+        out = 0
+        stack = [path]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            out += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+        return out
+
+
+class DryRunPlanner:
+    """."""
+
+    WORKERS = 16
+    COPY = 'copy'
+    SKIP = 'skip'
+    ROTATE = 'rotate'
+    LINK = 'link'
+    DELTA = 'delta'
+    ARCHIVE = 'archive'
+    NONE = 'none'
+    FAIL = 'fail'
+
+    def plan(self, task):
+        """."""
+        try:
+            out = self.plan_task(task)
+        except OSError:
+            out = (self.FAIL, 0, 0)
+        return out
+
+    def plan_task(self, task):
+        """."""
+        operations_builder = OperationsBuilder()
+        src, dst = task.source, task.destination
+        if not os.path.exists(src) or not os.path.exists(
+                os.path.dirname(dst)):
+            return (self.FAIL, 0, 0)
+        setting = operations_builder.build_copy(task.options).setting
+        if operations_builder.build_archive(task.options) is not None:
+            size = TaskScheduler(TaskScheduler.SIZE).get_size(src)
+            return (self.ARCHIVE, size, size)
+        if os.path.isfile(src) and not os.path.isdir(dst):
+            out = self.plan_file(src, dst, setting, os.path.dirname(dst))
+        elif os.path.isfile(src) and os.path.isdir(dst):
+            out = (self.NONE, 0, 0)
+        elif os.path.isdir(src) and os.path.isdir(dst):
+            out = self.plan_dir(src, dst, setting)
+        else:
+            out = (self.FAIL, 0, 0)
+        return out
+
+    def plan_dir(self, src, dst, setting):
+        """."""
+        treedst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+        actions = set()
+        nread = nwrite = 0
+        for dirpath, dirnames, filenames in os.walk(src):
+            dstdir = os.path.join(
+                treedst, os.path.relpath(dirpath, src))
+            for filename in filenames:
+                action, fr, fw = self.plan_file(
+                    os.path.join(dirpath, filename),
+                    os.path.normpath(os.path.join(dstdir, filename)),
+                    setting, dst)
+                actions.add(action)
+                nread += fr
+                nwrite += fw
+        for action in (self.FAIL, self.DELTA, self.ROTATE, self.COPY,
+                       self.LINK, self.SKIP):
+            if action in actions:
+                return (action, nread, nwrite)
+        return (self.SKIP, nread, nwrite)
+
+    def plan_file(self, src, dst, setting, root):
+        """."""
+        srcstat = os.stat(src)
+        size = srcstat.st_size
+        if setting.mode == CopySetting.SKIP:
+            if self.is_same(srcstat, dst):
+                return (self.SKIP, 0, 0)
+        elif setting.mode == CopySetting.LINK:
+            prev = os.path.join(setting.prev, os.path.relpath(dst, root))
+            if self.is_same(srcstat, prev):
+                return (self.LINK, 0, 0)
+        elif setting.mode == CopySetting.ROTATE:
+            return (self.ROTATE, size, size)
+        elif setting.mode == CopySetting.DELTA:
+            if size >= setting.min_delta and os.path.isfile(dst):
+                return (self.DELTA, size + os.path.getsize(dst), size)
+        return (self.COPY, size, size)
+
+    def is_same(self, srcstat, dst):
+        """."""
+        try:
+            dststat = os.stat(dst)
+        except OSError:
+            return False
+        return (srcstat.st_size == dststat.st_size
+                and srcstat.st_mtime_ns == dststat.st_mtime_ns)
+
+
+class DryRunTotals:
+    """."""
+
+    def __init__(self):
+        self.nread = 0
+        self.nwrite = 0
+        self.actions = collections.OrderedDict()
+
+    def add(self, action, nread, nwrite):
+        """."""
+        self.actions[action] = self.actions.get(action, 0) + 1
+        self.nread += nread
+        self.nwrite += nwrite
+
+
+class ThroughputHistory:
+    """."""
+
+    def __init__(self):
+        self.tasks = 0
+        self.nbytes = 0
+        self.elapsed = 0.0
+
+    def load(self, filename):
+        """."""
+        try:
+            with open(filename, encoding='utf-8') as fin:
+                for line in fin:
+                    self.add_line(line)
+        except OSError:
+            pass
+
+    def add_line(self, line):
+        """."""
+        try:
+            record = json.loads(line)
+            nbytes = int(record['bytes_read'])
+            elapsed = float(record['elapsed'])
+            result = record['result']
+        except (ValueError, KeyError, TypeError):
+            return
+        if result == 'OK' and nbytes > 0 and elapsed > 0:
+            self.tasks += 1
+            self.nbytes += nbytes
+            self.elapsed += elapsed
+
+    def get_speed(self):
+        """."""
+        if self.elapsed > 0:
+            out = self.nbytes / self.elapsed / (1024 * 1024)
+        else:
+            out = 0.0
+        return out
 
 
 class LogConfigurator:
@@ -496,8 +1256,16 @@ class Logger:
     LEVEL_WARNING = 2
     LEVEL_ERROR = 3
 
+    FLUSH_INTERVAL = 1.0
+    FLUSH_SIZE = 64 * 1024
+
     def __init__(self):
         self.config = None
+        self.queue = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+        self.logfiles = {}
+        self.failed = set()
 
     def set_config(self, config):
         """."""
@@ -506,17 +1274,107 @@ class Logger:
     def log_message(self, message, level):
         """."""
         if level >= self.config.level:
-            logfilename = self.config.filename
-            logfile = LogFile()
-            if not os.path.exists(logfilename):
-                datetime = time.strftime(
-                    '%Y-%m-%d %H:%M:%S', time.localtime())
-                logfile.open(logfilename)
-                logfile.write(LogMessages().get_file_header(datetime))
-            else:
-                logfile.open(logfilename)
-            logfile.write(message)
-            logfile.close()
+            self.start()
+            self.queue.put((self.config.filename, message))
+
+    def start(self):
+        """."""
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self.write_loop, daemon=True)
+                self.writer.start()
+
+    def flush(self):
+        """."""
+        writer = self.writer
+        if writer is not None:
+            done = threading.Event()
+            self.queue.put(done)
+            while not done.wait(self.FLUSH_INTERVAL):
+                if not writer.is_alive():
+                    break
+
+    def close(self):
+        """."""
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            self.queue.put(None)
+            writer.join()
+
+    def write_loop(self):
+        """."""
+        pending = 0
+        last = time.monotonic()
+        while True:
+            timeout = max(0.0, self.FLUSH_INTERVAL - (time.monotonic() - last))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self.close_files()
+                break
+            if isinstance(item, threading.Event):
+                self.flush_files()
+                pending, last = 0, time.monotonic()
+                item.set()
+                continue
+            if item:
+                filename, message = item
+                self.write_file(filename, message)
+                pending += len(message)
+            if (pending >= self.FLUSH_SIZE
+                    or time.monotonic() - last >= self.FLUSH_INTERVAL):
+                self.flush_files()
+                pending, last = 0, time.monotonic()
+
+    def write_file(self, filename, message):
+        """."""
+        if filename in self.failed:
+            return
+        try:
+            if filename not in self.logfiles:
+                self.logfiles[filename] = self.open_file(filename)
+            self.logfiles[filename].write(message)
+        except OSError as e:
+            self.failed.add(filename)
+            print('Error log: can\'t write: ' + filename
+                  + ': ' + str(e.strerror), file=sys.stderr)
+        except ValueError as e:
+            self.failed.add(filename)
+            print('Error log: can\'t write: ' + filename
+                  + ': ' + str(e), file=sys.stderr)
+
+    def open_file(self, filename):
+        """."""
+        logfile = LogFile()
+        if not os.path.exists(filename):
+            datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+            logfile.open(filename)
+            logfile.write(LogMessages().get_file_header(datetime))
+        else:
+            logfile.open(filename)
+        return logfile
+
+    def flush_files(self):
+        """."""
+        for filename, logfile in list(self.logfiles.items()):
+            try:
+                logfile.flush()
+            except (OSError, ValueError):
+                self.failed.add(filename)
+                del self.logfiles[filename]
+
+    def close_files(self):
+        """."""
+        for logfile in self.logfiles.values():
+            try:
+                logfile.close()
+            except (OSError, ValueError):
+                pass
+        self.logfiles.clear()
 
 
 class LogMessages:
@@ -537,82 +1395,396 @@ class LogFile:
 
     def open(self, filename):
         """."""
-        self.ofp = open(filename, 'a')
+        self.ofp = open(filename, 'a', errors='backslashreplace')
 
     def write(self, text):
         """."""
         print(text, file=self.ofp)
 
+    def flush(self):
+        """."""
+        self.ofp.flush()
+
     def close(self):
         """."""
         self.ofp.close()
 
 
-class ConsoleMessages:
+class TaskJournal:
     """."""
 
-    def get_progname(self):
-        """."""
-        out = '__PROGRAM_NAME__ __PROGRAM_VERSION__'
-        return out
+    SYNC_INTERVAL = 1.0
+    SYNC_COUNT = 1024
 
-    def get_configuration(self, filename):
-        """."""
-        fmt = 'Loading configuration from {}'
-        out = fmt.format(filename)
-        return out
+    def __init__(self):
+        self.ofp = None
+        self.done = set()
+        self.unsynced = 0
+        self.last_sync = 0.0
 
-    def get_logfile(self, filename):
+    def open(self, filename, resume=False):
         """."""
-        fmt = 'Set default logging to {}'
-        out = fmt.format(filename)
-        return out
+        self.done = set()
+        if resume:
+            self.load(filename)
+            self.ofp = open(filename, 'a', encoding='utf-8')
+        else:
+            self.ofp = open(filename, 'w', encoding='utf-8')
+            self.ofp.write('# Task journal of __PROGRAM_NAME__\n')
+        self.last_sync = time.monotonic()
 
-    def get_config_nofile(self):
+    def load(self, filename):
         """."""
-        out = 'no config file found'
-        return out
-
-    def get_config_empty(self):
+        if not os.path.exists(filename):
+            return
+        with open(filename, encoding='utf-8', errors='replace') as fin:
+            for line in fin:
+                if line.startswith('#') or not line.endswith('\n'):
+                    continue
+                self.done.add(line.rstrip('\n'))
+
+    def is_done(self, task):
         """."""
-        out = 'config file is empty'
-        return out
+        if not self.done or not os.path.lexists(task.destination):
+            return False
+        fingerprint = self.get_fingerprint(task.source)
+        return self.make_key(task, fingerprint) in self.done
 
-    def get_config_syntax(self):
+    def add(self, task):
         """."""
-        out = 'config file has incorrect syntax'
-        return out
+        if self.ofp is None:
+            return
+        fingerprint = task.fingerprint
+        if fingerprint is None:
+            fingerprint = self.get_fingerprint(task.source)
+        if fingerprint is None:
+            return
+        self.ofp.write(self.make_key(task, fingerprint) + '\n')
+        self.unsynced += 1
+        if (self.unsynced >= self.SYNC_COUNT
+                or time.monotonic() - self.last_sync >= self.SYNC_INTERVAL):
+            self.sync()
+
+    def sync(self):
+        """."""
+        if self.ofp is None or not self.unsynced:
+            return
+        self.ofp.flush()
+        os.fsync(self.ofp.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
 
-    def get_header(self, configfile, logfile):
+    def close(self):
         """."""
-        datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-        fmt = 'Started processing at {}\n'
-        out = fmt.format(datetime)
+        if self.ofp is not None:
+            try:
+                self.sync()
+            finally:
+                self.ofp.close()
+                self.ofp = None
+
+    def make_key(self, task, fingerprint):
+        """."""
+        options = [(i.name, sorted(i.params.items())) for i in task.options]
+        identity = (task.name, task.source, task.destination, options,
+                    fingerprint)
+        out = hashlib.sha256(repr(identity).encode('utf-8')).hexdigest()
         return out
 
-    def get_task_left(self, name, number, total):
+    def get_fingerprint(self, path):
         """."""
-        timehms = time.strftime('%H:%M:%S', time.localtime())
-        fmt = '{}/{} started at {} {} ... '
-        out = fmt.format(number, total, timehms, name)
-        return out
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        fingerprint = SourceFingerprint(st)
+        stack = [path] if stat.S_ISDIR(st.st_mode) else []
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        est = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    fingerprint.add(est)
+                    if stat.S_ISDIR(est.st_mode):
+                        stack.append(entry.path)
+        return fingerprint.get()
+
+
+class SourceFingerprint:
+    """."""
 
-    def get_task_right(self, status):
+    def __init__(self, st):
+        self.st = st
+        self.nfiles = 0
+        self.size = 0
+        self.mtime = st.st_mtime_ns
+
+    def add(self, st):
         """."""
-        out = ('OK', 'SKIPPED', 'FAILED', 'INTERRUPT')[status]
-        return out
+        self.nfiles += 1
+        self.size += st.st_size
+        self.mtime = max(self.mtime, st.st_mtime_ns)
 
-    def get_footer(self, total, success, skipped, failed):
+    def get(self):
         """."""
-        datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
-        fmt = ('\n'
-               'Completed processing at {}\n'
-               'Success: {}, Failed: {}, Skipped: {}, Total: {}')
-        out = fmt.format(datetime, success, failed, skipped, total)
-        return out
+        st = self.st
+        if not stat.S_ISDIR(st.st_mode):
+            return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        return (st.st_dev, st.st_ino, self.nfiles, self.size, self.mtime)
 
 
-class SystemOperations:
+class ReportFile:
+    """."""
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self):
+        self.ofp = None
+        self.last_flush = 0.0
+
+    def open(self, filename):
+        """."""
+        self.ofp = open(filename, 'a', encoding='utf-8')
+        self.last_flush = time.monotonic()
+
+    def is_open(self):
+        """."""
+        return self.ofp is not None
+
+    def write(self, text):
+        """."""
+        print(text, file=self.ofp)
+        if time.monotonic() - self.last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """."""
+        if self.ofp is not None:
+            self.ofp.flush()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        """."""
+        if self.ofp is not None:
+            self.ofp.close()
+            self.ofp = None
+
+
+class Profiler:
+    """."""
+
+    TOP_FUNCTIONS = 30
+    TOP_ALLOCATIONS = 15
+
+    def __init__(self):
+        self.profile = None
+        self.snapshot = None
+        self.peak = 0
+        self.running = False
+
+    def start(self):
+        """."""
+        tracemalloc.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.running = True
+
+    def stop(self):
+        """."""
+        self.profile.disable()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.running = False
+
+    def is_running(self):
+        """."""
+        return self.running
+
+    def save(self, filename):
+        """."""
+        with open(filename, 'w', encoding='utf-8') as fout:
+            fout.write(self.get_summary())
+
+    def get_summary(self):
+        """."""
+        text = io.StringIO()
+        print('Peak memory: {} bytes'.format(self.peak), file=text)
+        print('\nTop {} allocations by line:'.format(
+            self.TOP_ALLOCATIONS), file=text)
+        for statistic in self.snapshot.statistics(
+                'lineno')[:self.TOP_ALLOCATIONS]:
+            print(statistic, file=text)
+        print('\nTop {} functions by cumulative time'
+              ' (main thread):'.format(self.TOP_FUNCTIONS), file=text)
+        stats = pstats.Stats(self.profile, stream=text)
+        stats.sort_stats('cumulative').print_stats(self.TOP_FUNCTIONS)
+        print('Top {} functions by own time (main thread):'.format(
+            self.TOP_FUNCTIONS), file=text)
+        stats.sort_stats('tottime').print_stats(self.TOP_FUNCTIONS)
+        return text.getvalue()
+
+
+class ConsoleMessages:
+    """."""
+
+    def get_progname(self):
+        """."""
+        out = '__PROGRAM_NAME__ __PROGRAM_VERSION__'
+        return out
+
+    def get_configuration(self, filename):
+        """."""
+        fmt = 'Loading configuration from {}'
+        out = fmt.format(filename)
+        return out
+
+    def get_logfile(self, filename):
+        """."""
+        fmt = 'Set default logging to {}'
+        out = fmt.format(filename)
+        return out
+
+    def get_hashcache(self, filename):
+        """."""
+        fmt = 'Set hash cache to {}'
+        out = fmt.format(filename)
+        return out
+
+    def get_hashcache_error(self, filename, error):
+        """."""
+        fmt = 'Error hash cache: can\'t save: {}: {}'
+        out = fmt.format(filename, error)
+        return out
+
+    def get_plancache(self, filename):
+        """."""
+        fmt = 'Set plan cache to {}'
+        out = fmt.format(filename)
+        return out
+
+    def get_plancache_loaded(self):
+        """."""
+        out = 'Config is unchanged, tasks are loaded from plan cache'
+        return out
+
+    def get_journal(self, filename):
+        """."""
+        fmt = 'Set journal to {}'
+        out = fmt.format(filename)
+        return out
+
+    def get_resumed(self, count):
+        """."""
+        fmt = '\nResumed: {} tasks were done by the previous run'
+        out = fmt.format(count)
+        return out
+
+    def get_schedule(self, mode):
+        """."""
+        fmt = 'Schedule tasks by {}'
+        out = fmt.format(mode)
+        return out
+
+    def get_reportfile(self, filename):
+        """."""
+        fmt = 'Set report to {}'
+        out = fmt.format(filename)
+        return out
+
+    def get_config_nofile(self):
+        """."""
+        out = 'no config file found'
+        return out
+
+    def get_config_empty(self):
+        """."""
+        out = 'config file is empty'
+        return out
+
+    def get_config_syntax(self, lineno, reason):
+        """."""
+        fmt = 'config file has incorrect syntax at line {}: {}'
+        out = fmt.format(lineno, reason)
+        return out
+
+    def get_header(self, configfile, logfile):
+        """."""
+        datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        fmt = 'Started processing at {}\n'
+        out = fmt.format(datetime)
+        return out
+
+    def get_task_left(self, name, number, total, begin=None):
+        """."""
+        timehms = time.strftime('%H:%M:%S', time.localtime(begin))
+        fmt = '{}/{} started at {} {} ... '
+        out = fmt.format(number, total, timehms, name)
+        return out
+
+    def get_task_right(self, status):
+        """."""
+        out = ('OK', 'SKIPPED', 'FAILED', 'INTERRUPT')[status]
+        return out
+
+    def get_plan_task(self, name, number, total, action, nread, nwrite):
+        """."""
+        fmt = '{}/{} {} ... {} read {} write {} bytes'
+        out = fmt.format(number, total, name, action.upper(), nread, nwrite)
+        return out
+
+    def get_plan_footer(self, totals, history, jobs):
+        """."""
+        fmt = ('\n'
+               'Dry run, nothing is changed\n'
+               '{}\n'
+               'Read: {} bytes, Write: {} bytes\n'
+               '{}')
+        actions = ', '.join(
+            '{}: {}'.format(action.capitalize(), count)
+            for action, count in totals.actions.items())
+        speed = history.get_speed()
+        if speed > 0:
+            seconds = totals.nread / (speed * 1024 * 1024) / max(1, jobs)
+            estimate = ('Estimated time: {} at {:.2f} MB/s per job'
+                        ' from {} tasks of the report').format(
+                            self.get_duration(seconds),
+                            speed, history.tasks)
+        else:
+            estimate = 'Estimated time: unknown, no past runs in the report'
+        out = fmt.format(actions, totals.nread, totals.nwrite, estimate)
+        return out
+
+    def get_duration(self, seconds):
+        """."""
+        minutes, secs = divmod(int(round(seconds)), 60)
+        hours, minutes = divmod(minutes, 60)
+        out = '{:02d}:{:02d}:{:02d}'.format(hours, minutes, secs)
+        return out
+
+    def get_profile(self, filename, peak):
+        """."""
+        fmt = 'Profile is written to {}, peak memory {:.2f} MiB'
+        out = fmt.format(filename, peak / (1024 * 1024))
+        return out
+
+    def get_footer(self, total, success, skipped, failed):
+        """."""
+        datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        fmt = ('\n'
+               'Completed processing at {}\n'
+               'Success: {}, Failed: {}, Skipped: {}, Total: {}')
+        out = fmt.format(datetime, success, failed, skipped, total)
+        return out
+
+
+class SystemOperations:
     """."""
 
     STATUS_OK = 0
@@ -620,36 +1792,105 @@ class SystemOperations:
     STATUS_FAILED = 2
     STATUS_CTRLC = 3
 
-    def execute_task(self, task):
+    def __init__(self, hash_cache=None, process_pool=None):
+        self.hash_cache = hash_cache
+        self.process_pool = process_pool
+        self.interrupted = threading.Event()
+
+    def interrupt(self):
         """."""
-        operations_builder = OperationsBuilder()
-        copy_operation = operations_builder.build_copy(task.options)
-        hash_operation = operations_builder.build_hash(task.options)
-        archive_operation = operations_builder.build_archive(task.options)
-        cipher_operation = operations_builder.build_cipher(task.options)
-        context_commands = ContextCommands(
+        self.interrupted.set()
+
+    def execute_tasks(self, tasks):
+        """."""
+        context_commands = self.build_context(tasks[0].options)
+        timer = PhaseTimer()
+        out = []
+
+        begin = timer.start()
+        fan_out = len(tasks) > 1 and context_commands.can_fan_out(
+            tasks[0].source, [task.destination for task in tasks])
+        timer.stop('check', begin)
+        if fan_out:
+            begin = time.time()
+            fingerprint = SourceFingerprint(os.stat(tasks[0].source)).get()
+            results = context_commands.file_to_files(
+                tasks[0].source, [task.destination for task in tasks])
+            for task, command_result in zip(tasks, results):
+                task.begin = begin
+                command_result.phases = (
+                    timer.get_phases() + command_result.phases)
+                command_result.fingerprint = fingerprint
+                out.append(self.make_result(task, command_result))
+            return out
+        for task in tasks:
+            if self.interrupted.is_set():
+                break
+            result = self.execute_task(task)
+            out.append(result)
+            if result[0] == self.STATUS_CTRLC:
+                break
+        return out
+
+    def build_context(self, options):
+        """."""
+        operations_builder = OperationsBuilder(
+            self.hash_cache, self.interrupted, self.process_pool)
+        copy_operation = operations_builder.build_copy(options)
+        hash_operation = operations_builder.build_hash(options)
+        archive_operation = operations_builder.build_archive(options)
+        cipher_operation = operations_builder.build_cipher(options)
+        out = ContextCommands(
             copy_operation, hash_operation,
             archive_operation, cipher_operation)
+        return out
+
+    def execute_task(self, task):
+        """."""
+        context_commands = self.build_context(task.options)
         command_result = CommandResult()
-        task_converter = TaskConverter()
+
+        timer = PhaseTimer()
 
         task.begin = time.time()
         src, dst = task.source, task.destination
-        if not os.path.exists(src):
+        begin = timer.start()
+        try:
+            srcstat = os.stat(src)
+        except OSError:
             raise SystemOperationsPathError('Can\'t find source ' + src)
         if not os.path.exists(os.path.dirname(dst)):
             raise SystemOperationsPathError(
                 'Can\'t find destination directory ' + dst)
-        if os.path.isfile(src) and not os.path.isdir(dst):
+        src_is_file = stat.S_ISREG(srcstat.st_mode)
+        src_is_dir = stat.S_ISDIR(srcstat.st_mode)
+        dst_is_dir = os.path.isdir(dst)
+        timer.stop('check', begin)
+        if src_is_file and not dst_is_dir:
             command_result = context_commands.file_to_file(src, dst)
-        elif os.path.isfile(src) and os.path.isdir(dst):
+        elif src_is_file and dst_is_dir:
             command_result = context_commands.file_to_dir(src, dst)
-        elif os.path.isdir(src) and os.path.isdir(dst):
+        elif src_is_dir and dst_is_dir:
             command_result = context_commands.dir_to_dir(src, dst)
         else:
             raise SystemOperationsContextError(
                 'Can\'t select context: {} to {}'.format(src, dst))
+        timer.add_phases(command_result.phases)
+        command_result.phases = timer.get_phases()
+        if src_is_file:
+            command_result.fingerprint = SourceFingerprint(srcstat).get()
+        return self.make_result(task, command_result)
+
+    def make_result(self, task, command_result):
+        """."""
+        task_converter = TaskConverter()
+
         task.status = command_result.status
+        task.nbytes = command_result.nbytes
+        task.nwritten = command_result.nwritten
+        task.stages = command_result.stages
+        task.phases = command_result.phases
+        task.fingerprint = command_result.fingerprint
         task.end = time.time()
         report = task_converter.task_to_report(task)
         if command_result.flags & command_result.F_OK:
@@ -663,319 +1904,2259 @@ class SystemOperations:
         return out
 
 
-class OperationsBuilder:
+class TasksCounter:
+    """."""
+
+    def __init__(self):
+        self.success = 0
+        self.skipped = 0
+        self.failed = 0
+        self.resumed = 0
+
+    def resume(self):
+        """."""
+        self.resumed += 1
+        self.skipped += 1
+
+    def count(self, status):
+        """."""
+        if status == SystemOperations.STATUS_OK:
+            self.success += 1
+        elif status == SystemOperations.STATUS_SKIPPED:
+            self.skipped += 1
+        elif status == SystemOperations.STATUS_FAILED:
+            self.failed += 1
+
+
+class DeviceLimiter:
+    """."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def execute(self, sysoperations, tasks):
+        """."""
+        if self.limit <= 0:
+            return sysoperations.execute_tasks(tasks)
+        devices = sorted(
+            set(self.get_device(task.destination) for task in tasks),
+            key=str)
+        semaphores = [self.get_semaphore(device) for device in devices]
+        for semaphore in semaphores:
+            semaphore.acquire()
+        try:
+            return sysoperations.execute_tasks(tasks)
+        finally:
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+
+    def get_device(self, path):
+        """."""
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        try:
+            out = os.stat(path).st_dev
+        except OSError:
+            out = None
+        return out
+
+    def get_semaphore(self, device):
+        """."""
+        with self.lock:
+            if device not in self.semaphores:
+                self.semaphores[device] = threading.Semaphore(self.limit)
+            out = self.semaphores[device]
+        return out
+
+
+class OperationsBuilder:
+    """."""
+
+    def __init__(self, hash_cache=None, interrupted=None,
+                 process_pool=None):
+        self.hash_cache = hash_cache
+        self.interrupted = interrupted
+        self.process_pool = process_pool
+
+    def build_copy(self, options):
+        """."""
+        opt = [i for i in options if i.name == 'copy']
+        setting = CopySetting()
+        setting.mode = CopySetting.ERROR
+        if opt:
+            mode = opt[0].params['mode']
+            if mode == 'skip':
+                setting.mode = CopySetting.SKIP
+            elif mode == 'replace':
+                setting.mode = CopySetting.REPLACE
+            elif mode == 'rotate':
+                setting.mode = CopySetting.ROTATE
+            elif mode == 'link' and 'prev' in opt[0].params:
+                setting.mode = CopySetting.LINK
+                setting.prev = opt[0].params['prev']
+            elif mode == 'link':
+                setting.mode = CopySetting.REPLACE
+            elif mode == 'delta':
+                setting.mode = CopySetting.DELTA
+                setting.min_delta = opt[0].params.get(
+                    'min', setting.min_delta)
+            setting.count = max(1, opt[0].params.get('count', setting.count))
+            setting.workers = max(
+                1, opt[0].params.get('workers', setting.workers))
+        if setting.mode in (CopySetting.SKIP, CopySetting.LINK):
+            out = CopyOperation(
+                setting, self.build_compare_hash(options), self.interrupted)
+        else:
+            out = CopyOperation(setting, None, self.interrupted)
+        return out
+
+    def build_compare_hash(self, options):
+        """."""
+        out = self.build_hash(options)
+        if out is None:
+            setting = HashSetting()
+            setting.algo = HashSetting.MD5
+            out = HashOperation(setting, self.hash_cache, self.interrupted)
+        return out
+
+    def build_hash(self, options):
+        """."""
+        opt = [i for i in options if i.name == 'hash']
+        if opt:
+            setting = HashSetting()
+            algo = opt[0].params['algo']
+            if algo == 'md5':
+                setting.algo = HashSetting.MD5
+            elif algo == 'sha1':
+                setting.algo = HashSetting.SHA1
+            elif algo == 'sha256':
+                setting.algo = HashSetting.SHA256
+            elif algo == 'blake2b':
+                setting.algo = HashSetting.BLAKE2B
+            elif algo == 'blake2s':
+                setting.algo = HashSetting.BLAKE2S
+            setting.verify = opt[0].params.get('verify', False)
+            out = HashOperation(setting, self.hash_cache, self.interrupted)
+        else:
+            out = None
+        return out
+
+    def build_archive(self, options):
+        """."""
+        opt = [i for i in options if i.name == 'arch']
+        if opt:
+            setting = ArchiveSetting()
+            algo = opt[0].params['algo']
+            if algo == 'tar':
+                setting.algo = ArchiveSetting.TAR
+            elif algo == 'bz2':
+                setting.algo = ArchiveSetting.BZ2
+            setting.workers = opt[0].params.get('workers', 0)
+            if setting.workers < 1:
+                setting.workers = os.cpu_count() or 1
+            out = ArchiveOperation(
+                setting, self.interrupted, self.process_pool)
+        else:
+            out = None
+        return out
+
+    def build_cipher(self, options):
+        """."""
+        opt = [i for i in options if i.name == 'cipher']
+        if opt:
+            setting = CipherSetting()
+            algo = opt[0].params['algo']
+            if algo == 'xor':
+                setting.algo = CipherSetting.XOR
+            elif algo == 'aes':
+                setting.algo = CipherSetting.AES
+            setting.password = opt[0].params.get('password')
+            out = CipherOperation(setting, self.interrupted)
+        else:
+            out = None
+        return out
+
+
+class ContextCommands:
+    """."""
+
+    def __init__(self, copy_operation, hash_operation,
+                 archive_operation, cipher_operation):
+        self.copy_operation = copy_operation
+        self.hash_operation = hash_operation
+        self.archive_operation = archive_operation
+        self.cipher_operation = cipher_operation
+
+    def file_to_file(self, src, dst):
+        """."""
+        if not self.is_cipher_ready():
+            return self.make_cipher_error()
+        if self.archive_operation is not None:
+            return self.make_archive(src, dst)
+        timer = PhaseTimer()
+        if self.copy_operation.is_skipping():
+            begin = timer.start()
+            unchanged = self.copy_operation.is_unchanged(src, dst)
+            timer.stop('compare', begin)
+            if unchanged:
+                out = self.make_skip_result()
+                out.phases = timer.get_phases()
+                return out
+        if self.copy_operation.is_linking():
+            begin = timer.start()
+            link_result = self.copy_operation.link_file(src, dst)
+            timer.stop('link', begin)
+            if link_result is not None:
+                out = self.make_link_result(src, dst, link_result, timer)
+                out.phases = timer.get_phases()
+                return out
+        if self.hash_operation is not None:
+            digest = self.hash_operation.new_digest()
+            srcstat = os.stat(src)
+        else:
+            digest = srcstat = None
+        stream = self.make_stream(digest)
+        begin = timer.start()
+        copy_result = self.copy_operation.copy_file(src, dst, stream)
+        timer.stop('copy', begin, stream.nread)
+        out = self.make_copy_result(
+            src, dst, copy_result, digest, srcstat, timer)
+        out.nwritten = stream.nwritten
+        out.stages = stream.get_timings()
+        out.phases = timer.get_phases()
+        return out
+
+    def file_to_files(self, src, dsts):
+        """."""
+        results = {}
+        copy_dsts = []
+        timer = PhaseTimer()
+
+        for dst in dsts:
+            if not self.copy_operation.is_skipping():
+                copy_dsts.append(dst)
+                continue
+            begin = timer.start()
+            unchanged = self.copy_operation.is_unchanged(src, dst)
+            timer.stop('compare', begin)
+            if unchanged:
+                results[dst] = self.make_skip_result()
+            else:
+                copy_dsts.append(dst)
+        if copy_dsts:
+            if self.hash_operation is not None:
+                digest = self.hash_operation.new_digest()
+                srcstat = os.stat(src)
+            else:
+                digest = srcstat = None
+            stream = self.make_stream(digest)
+            begin = timer.start()
+            copy_results = self.copy_operation.copy_file_multi(
+                src, copy_dsts, stream)
+            timer.stop('copy', begin, stream.nread)
+            for dst, copy_result in zip(copy_dsts, copy_results):
+                results[dst] = self.make_copy_result(
+                    src, dst, copy_result, digest, srcstat, timer)
+                results[dst].nwritten = stream.nwritten
+                results[dst].stages = stream.get_timings()
+        phases = timer.get_phases()
+        for result in results.values():
+            result.phases = phases
+        out = [results[dst] for dst in dsts]
+        return out
+
+    def make_stream(self, digest):
+        """."""
+        stages = []
+        if self.cipher_operation is not None:
+            stages.append(self.cipher_operation.make_stage())
+        if digest is not None:
+            stages.append(HashStage(digest))
+        out = StreamPipeline(stages)
+        return out
+
+    def is_cipher_ready(self):
+        """."""
+        if self.cipher_operation is None:
+            return True
+        return self.cipher_operation.get_error() is None
+
+    def make_cipher_error(self):
+        """."""
+        out = CommandResult()
+        out.flags |= CommandResult.F_FAIL
+        out.status = (1, self.cipher_operation.get_error())
+        return out
+
+    def can_fan_out(self, src, dsts):
+        """."""
+        if not self.copy_operation.can_fan_out():
+            return False
+        if self.archive_operation is not None:
+            return False
+        if self.cipher_operation is not None:
+            return False
+        if len(set(dsts)) != len(dsts) or not os.path.isfile(src):
+            return False
+        for dst in dsts:
+            if os.path.isdir(dst) or not os.path.isdir(os.path.dirname(dst)):
+                return False
+        return True
+
+    def make_skip_result(self):
+        """."""
+        out = CommandResult()
+        out.flags |= CommandResult.F_SKIP
+        out.status = (0, 'Skipped')
+        return out
+
+    def make_link_result(self, src, dst, link_result, timer):
+        """."""
+        out = CommandResult()
+
+        lb, ls, lo = link_result
+        out.flags |= CommandResult.F_OK
+        out.status = ls
+        hashfile = HashFile().get_path(src, dst)
+        if self.hash_operation is not None and not os.path.exists(hashfile):
+            begin = timer.start()
+            hb, hs, ho = self.hash_operation.hash_file(src)
+            timer.stop('hash', begin)
+            if hb:
+                self.write_hashfile(src, dst, ho, timer)
+            else:
+                out.flags = CommandResult.F_FAIL
+                out.status = hs
+
+        return out
+
+    def make_copy_result(self, src, dst, copy_result, digest, srcstat,
+                         timer):
+        """."""
+        out = CommandResult()
+
+        cb, cs, co = copy_result
+        if cb:
+            out.flags |= CommandResult.F_OK
+            out.status = cs
+            out.nbytes = co
+        else:
+            out.flags |= CommandResult.F_FAIL
+            out.status = cs
+        if cb and digest is not None:
+            hb, hs, ho = self.verify_file(dst, digest, timer)
+            if hb:
+                if self.cipher_operation is None:
+                    self.hash_operation.remember(src, srcstat, ho)
+                self.write_hashfile(src, dst, ho, timer)
+            else:
+                out.flags = CommandResult.F_FAIL
+                out.status = hs
+
+        return out
+
+    def verify_file(self, path, digest, timer):
+        """."""
+        if not self.hash_operation.setting.verify:
+            return self.hash_operation.verify_file(path, digest.hexdigest())
+        begin = timer.start()
+        out = self.hash_operation.verify_file(path, digest.hexdigest())
+        timer.stop('verify', begin)
+        return out
+
+    def write_hashfile(self, src, dst, hashtext, timer):
+        """."""
+        begin = timer.start()
+        hashfile = HashFile().get_path(src, dst)
+        with open(hashfile, 'w', encoding='utf-8') as hashfout:
+            print(hashtext, file=hashfout)
+        timer.stop('hashfile', begin)
+
+    def make_archive(self, src, archive):
+        """."""
+        if not self.is_cipher_ready():
+            return self.make_cipher_error()
+        out = CommandResult()
+        timer = PhaseTimer()
+
+        if self.hash_operation is not None:
+            digest = self.hash_operation.new_digest()
+        else:
+            digest = None
+        stream = self.make_stream(digest)
+        begin = timer.start()
+        if os.path.isdir(src):
+            ab, ast, ao = self.archive_operation.archive_dir(
+                src, archive, stream)
+        else:
+            ab, ast, ao = self.archive_operation.archive_file(
+                src, archive, stream)
+        timer.stop('archive', begin, stream.nread)
+        out.stages = stream.get_timings()
+        out.phases = timer.get_phases()
+        if self.archive_operation.is_interrupted():
+            out.flags |= CommandResult.F_INTER
+            return out
+        if ab:
+            out.flags |= CommandResult.F_OK
+            out.status = ast
+            out.nbytes = stream.nread
+            out.nwritten = stream.nwritten
+        else:
+            out.flags |= CommandResult.F_FAIL
+            out.status = ast
+        if ab and digest is not None:
+            hb, hs, ho = self.verify_file(archive, digest, timer)
+            if hb:
+                self.write_hashfile(archive, archive, ho, timer)
+            else:
+                out.flags = CommandResult.F_FAIL
+                out.status = hs
+            out.phases = timer.get_phases()
+
+        return out
+
+    def file_to_dir(self, src, dst):
+        """."""
+        if self.archive_operation is not None:
+            return self.make_archive(
+                src, os.path.join(dst, self.archive_operation.get_name(src)))
+        out = CommandResult()
+        out.flags |= CommandResult.F_OK
+        out.status = (0, 'Success')
+        return out
+
+    def dir_to_dir(self, src, dst):
+        """."""
+        if self.archive_operation is not None:
+            return self.make_archive(
+                src, os.path.join(dst, self.archive_operation.get_name(src)))
+        out = CommandResult()
+
+        treedst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+        self.copy_operation.set_root(dst)
+        cb, cs, co = self.copy_operation.copy_dir(
+            src, treedst, self.file_to_file)
+        if co.interrupted:
+            out.flags |= CommandResult.F_INTER
+        elif not cb:
+            out.flags |= CommandResult.F_FAIL
+        elif co.files == 0 and co.skipped > 0:
+            out.flags |= CommandResult.F_SKIP
+        else:
+            out.flags |= CommandResult.F_OK
+        out.status = cs
+        out.nbytes = co.nbytes
+        out.nwritten = co.nwritten
+        out.stages = co.get_stages()
+        out.phases = co.phases.get_phases()
+        if co.fingerprint is not None:
+            out.fingerprint = co.fingerprint.get()
+        return out
+
+
+class CommandResult:
+    """."""
+
+    F_OK = 0x1
+    F_FAIL = 0x2
+    F_SKIP = 0x4
+    F_INTER = 0x8
+
+    def __init__(self):
+        self.flags = 0
+        self.status = None
+        self.nbytes = 0
+        self.nwritten = 0
+        self.stages = []
+        self.phases = []
+        self.fingerprint = None
+
+
+class CopySetting:
+    """."""
+
+    ERROR = 0
+    SKIP = 1
+    REPLACE = 2
+    ROTATE = 3
+    LINK = 4
+    DELTA = 5
+
+    def __init__(self):
+        self.mode = None
+        self.count = 5
+        self.workers = 4
+        self.prev = None
+        self.min_delta = 16 * 1024 * 1024
+
+
+class CopyOperation:
+    """."""
+
+    def __init__(self, setting, hash_operation=None, interrupted=None):
+        self.setting = setting
+        self.hash_operation = hash_operation
+        self.interrupted = interrupted
+        self.root = None
+
+    def copy_file(self, src, dst, stream=None):
+        """."""
+        copier = Copier(self.interrupted)
+        out = (False, None, None)
+        if self.setting.mode == CopySetting.ERROR:
+            cs, cn = copier.copy_file_error(src, dst, stream)
+        elif self.setting.mode == CopySetting.SKIP:
+            cs, cn = copier.copy_file_skip(src, dst, stream)
+        elif self.setting.mode in (CopySetting.REPLACE, CopySetting.LINK):
+            cs, cn = copier.copy_file_replace(src, dst, stream)
+        elif self.setting.mode == CopySetting.ROTATE:
+            cs, cn = copier.copy_file_rotate(
+                src, dst, self.setting.count, stream)
+        elif self.setting.mode == CopySetting.DELTA:
+            cs, cn = copier.copy_file_delta(
+                src, dst, self.setting.min_delta, stream)
+        else:
+            return out
+        if cs[0] == 0:
+            out = (True, cs, cn)
+        else:
+            out = (False, cs, None)
+        return out
+
+    def copy_file_multi(self, src, dsts, stream=None):
+        """."""
+        copier = Copier(self.interrupted)
+        if self.setting.mode == CopySetting.ROTATE:
+            statuses = copier.copy_files_rotate(
+                src, dsts, self.setting.count, stream)
+        else:
+            statuses = copier.copy_files_stream(src, dsts, stream)
+        out = []
+        for cs, cn in statuses:
+            if cs[0] == 0:
+                out.append((True, cs, cn))
+            else:
+                out.append((False, cs, None))
+        return out
+
+    def is_unchanged(self, src, dst):
+        """."""
+        if self.setting.mode != CopySetting.SKIP:
+            return False
+        comparer = FileComparer()
+        return comparer.is_same(src, dst, self.hash_operation)
+
+    def is_linking(self):
+        """."""
+        return self.setting.mode == CopySetting.LINK
+
+    def is_skipping(self):
+        """."""
+        return self.setting.mode == CopySetting.SKIP
+
+    def can_fan_out(self):
+        """."""
+        return self.setting.mode not in (CopySetting.LINK, CopySetting.DELTA)
+
+    def set_root(self, root):
+        """."""
+        self.root = root
+
+    def get_previous(self, dst):
+        """."""
+        root = self.root
+        if root is None:
+            root = os.path.dirname(dst)
+        out = os.path.join(self.setting.prev, os.path.relpath(dst, root))
+        return out
+
+    def link_file(self, src, dst):
+        """."""
+        if not self.is_linking():
+            return None
+        prev = self.get_previous(dst)
+        comparer = FileComparer()
+        if not comparer.is_same(src, prev, self.hash_operation, False):
+            return None
+        copier = Copier(self.interrupted)
+        cs = copier.link_file_previous(src, prev, dst)
+        if cs[0] == 0:
+            out = (True, cs, 0)
+        else:
+            out = None
+        return out
+
+    def copy_dir(self, src, dst, file_command):
+        """."""
+        tree_copier = TreeCopier(
+            file_command, self.setting.workers, self.interrupted)
+        totals = tree_copier.copy_tree(src, dst)
+        if totals.failed == 0:
+            cs = (0, 'Success: ' + totals.get_summary())
+            out = (True, cs, totals)
+        else:
+            cs = (1, 'Error tree: ' + totals.get_summary()
+                  + ': ' + totals.first_error)
+            out = (False, cs, totals)
+        return out
+
+
+class HashSetting:
+    """."""
+
+    MD5 = 0
+    SHA256 = 1
+    SHA1 = 2
+    BLAKE2B = 3
+    BLAKE2S = 4
+
+    def __init__(self):
+        self.algo = None
+        self.verify = False
+
+
+class HashOperation:
+    """."""
+
+    def __init__(self, setting, cache=None, interrupted=None):
+        self.setting = setting
+        self.cache = cache
+        self.interrupted = interrupted
+
+    def hash_file(self, path):
+        """."""
+        if self.cache is None:
+            return self.compute_file(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return self.compute_file(path)
+        algo = self.get_name()
+        hashtext = self.cache.lookup(st, algo)
+        if hashtext is not None:
+            return (True, (0, 'Success'), hashtext)
+        out = self.compute_file(path)
+        if out[0]:
+            self.cache.store(path, st, algo, out[2])
+        return out
+
+    def remember(self, path, st, hashtext):
+        """."""
+        if self.cache is not None:
+            self.cache.store(path, st, self.get_name(), hashtext)
+
+    def get_name(self):
+        """."""
+        return self.new_digest().name
+
+    def compute_file(self, path):
+        """."""
+        hasher = Hasher(self.interrupted)
+        if self.setting.algo == HashSetting.MD5:
+            s, o = hasher.hash_md5_file(path)
+        elif self.setting.algo == HashSetting.SHA1:
+            s, o = hasher.hash_sha1_file(path)
+        elif self.setting.algo == HashSetting.SHA256:
+            s, o = hasher.hash_sha256_file(path)
+        elif self.setting.algo == HashSetting.BLAKE2B:
+            s, o = hasher.hash_blake2b_file(path)
+        elif self.setting.algo == HashSetting.BLAKE2S:
+            s, o = hasher.hash_blake2s_file(path)
+        if s[0] == 0:
+            out = (True, s, o)
+        else:
+            out = (False, s, None)
+        return out
+
+    def new_digest(self):
+        """."""
+        if self.setting.algo == HashSetting.MD5:
+            out = hashlib.md5()
+        elif self.setting.algo == HashSetting.SHA1:
+            out = hashlib.sha1()
+        elif self.setting.algo == HashSetting.SHA256:
+            out = hashlib.sha256()
+        elif self.setting.algo == HashSetting.BLAKE2B:
+            out = hashlib.blake2b()
+        elif self.setting.algo == HashSetting.BLAKE2S:
+            out = hashlib.blake2s()
+        return out
+
+    def verify_file(self, path, hashtext):
+        """."""
+        if not self.setting.verify:
+            return (True, (0, 'Success'), hashtext)
+        hb, hs, ho = self.compute_file(path)
+        if not hb:
+            out = (False, hs, None)
+        elif ho != hashtext:
+            out = (False,
+                   (1, 'Error verify: hash mismatch: ' + path),
+                   None)
+        else:
+            out = (True, hs, ho)
+        return out
+
+    def hash_dir(self, path):
+        """."""
+        return (True, (0, 'Success'), '')
+
+
+class HashCache:
+    """."""
+
+    LOAD_ERRORS = (OSError, ValueError)
+
+    def __init__(self):
+        self.filename = None
+        self.force = False
+        self.entries = {}
+        self.touched = set()
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def load(self, filename, force=False):
+        """."""
+        self.filename = filename
+        self.force = force
+        self.entries = {}
+        if not os.path.exists(filename):
+            return
+        try:
+            self.read_entries(filename)
+        except self.LOAD_ERRORS:
+            self.entries = {}
+
+    def read_entries(self, filename):
+        """."""
+        with open(filename, encoding='utf-8',
+                  errors='surrogateescape') as fin:
+            for line in fin:
+                if line.startswith('#'):
+                    continue
+                fields = line.rstrip('\n').split(' ', 6)
+                if len(fields) != 7:
+                    continue
+                algo, dev, ino, size, mtime, hashtext, path = fields
+                try:
+                    key = (algo, int(dev), int(ino), int(size), int(mtime))
+                except ValueError:
+                    continue
+                self.entries[key] = (path, hashtext)
+
+    def is_loaded(self):
+        """."""
+        return self.filename is not None
+
+    def save(self):
+        """."""
+        if self.filename is None:
+            return
+        with self.lock:
+            kept = {}
+            for key, entry in self.entries.items():
+                if key in self.touched or self.is_actual(key, entry[0]):
+                    kept[key] = entry
+                else:
+                    self.changed = True
+            self.entries = kept
+            if not self.changed:
+                return
+            tmpname = self.filename + '.tmp'
+            with open(tmpname, 'w', encoding='utf-8',
+                      errors='surrogateescape') as fout:
+                fout.write('# Hash cache of __PROGRAM_NAME__\n')
+                for key, (path, hashtext) in self.entries.items():
+                    fout.write('{} {} {} {} {} {} {}\n'.format(
+                        key[0], key[1], key[2], key[3], key[4],
+                        hashtext, path))
+            try:
+                os.replace(tmpname, self.filename)
+            except OSError:
+                os.remove(tmpname)
+                raise
+            self.changed = False
+
+    def lookup(self, st, algo):
+        """."""
+        if self.force:
+            return None
+        key = self.make_key(st, algo)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.touched.add(key)
+        return entry[1]
+
+    def store(self, path, st, algo, hashtext):
+        """."""
+        if '\n' in path:
+            return
+        key = self.make_key(st, algo)
+        with self.lock:
+            self.entries[key] = (path, hashtext)
+            self.touched.add(key)
+            self.changed = True
+
+    def make_key(self, st, algo):
+        """."""
+        return (algo, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def is_actual(self, key, path):
+        """."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return self.make_key(st, key[0]) == key
+
+
+class PlanCache:
+    """."""
+
+    PLAN_VERSION = 4
+    FILE_MODE = 0o600
+    LOAD_ERRORS = (OSError, KeyError, IndexError, TypeError, ValueError)
+
+    def __init__(self):
+        self.filename = None
+        self.key = None
+        self.records = None
+
+    def load(self, filename, configname, force=False):
+        """."""
+        self.filename = filename
+        self.key = self.make_key(configname)
+        self.records = None
+        if force or not os.path.exists(filename):
+            return False
+        try:
+            with open(filename, encoding='utf-8') as fin:
+                plan = json.load(fin)
+            if plan['key'] != list(self.key):
+                return False
+            records = self.decode_records(plan)
+        except self.LOAD_ERRORS:
+            return False
+        self.records = records
+        return True
+
+    def save(self, records):
+        """."""
+        if self.filename is None:
+            return
+        plan = self.encode_records(records)
+        plan['key'] = list(self.key)
+        tmpname = self.filename + '.tmp'
+        try:
+            fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         self.FILE_MODE)
+            with open(fd, 'w', encoding='utf-8') as fout:
+                os.fchmod(fout.fileno(), self.FILE_MODE)
+                json.dump(plan, fout, separators=(',', ':'))
+            os.replace(tmpname, self.filename)
+        except OSError:
+            pass
+
+    def encode_records(self, records):
+        """."""
+        options = []
+        indexes = {}
+        out = []
+        for record in records:
+            refs = []
+            for option in record.options:
+                if id(option) not in indexes:
+                    indexes[id(option)] = len(options)
+                    options.append([option.name, option.params])
+                refs.append(indexes[id(option)])
+            out.append([record.name, record.sources,
+                        record.destinations, refs])
+        return {'options': options, 'records': out}
+
+    def decode_records(self, plan):
+        """."""
+        options = []
+        for name, params in plan['options']:
+            if not isinstance(name, str) or not isinstance(params, dict):
+                raise ValueError('bad option')
+            option = RecordOption()
+            option.name = name
+            option.params = params
+            options.append(option)
+        out = []
+        for name, sources, destinations, refs in plan['records']:
+            if not (isinstance(name, str)
+                    and self.is_list_of(sources, str)
+                    and self.is_list_of(destinations, str)
+                    and self.is_list_of(refs, int)):
+                raise ValueError('bad record')
+            record = Record()
+            record.name = name
+            record.sources = sources
+            record.destinations = destinations
+            record.options = [options[i] for i in refs]
+            out.append(record)
+        return out
+
+    def is_list_of(self, values, kind):
+        """."""
+        out = (isinstance(values, list)
+               and all(isinstance(i, kind) for i in values))
+        return out
+
+    def get_records(self):
+        """."""
+        return self.records
+
+    def make_key(self, configname):
+        """."""
+        digest = hashlib.sha256()
+        with open(configname, 'rb') as fin:
+            Hasher().update_buffered(fin, digest)
+        grammar = (ConfigParseTokenizer.HASH_ALGOS,
+                   ConfigParseTokenizer.COPY_MODES,
+                   ConfigParseTokenizer.ARCH_ALGOS,
+                   ConfigParseTokenizer.CIPHER_ALGOS,
+                   ConfigParseTokenizer.LOG_LEVELS)
+        out = (__version__, self.PLAN_VERSION, repr(grammar),
+               digest.hexdigest())
+        return out
+
+
+class ArchiveSetting:
+    """."""
+
+    TAR = 0
+    BZ2 = 1
+
+    def __init__(self):
+        self.algo = None
+        self.workers = 1
+
+
+class ArchiveOperation:
+    """."""
+
+    def __init__(self, setting, interrupted=None, process_pool=None):
+        self.setting = setting
+        self.interrupted = interrupted
+        self.process_pool = process_pool
+
+    def archive_file(self, src, dst, stream=None):
+        """."""
+        return self.archive_path(src, dst, stream)
+
+    def archive_dir(self, src, dst, stream=None):
+        """."""
+        return self.archive_path(src, dst, stream)
+
+    def archive_path(self, src, dst, stream):
+        """."""
+        archiver = Archiver(self.interrupted, self.process_pool)
+        out = (False, None, None)
+        if stream is None:
+            stream = StreamPipeline()
+        if self.setting.algo == ArchiveSetting.TAR:
+            cs, cn = archiver.archive_tar(src, dst, stream)
+        elif self.setting.algo == ArchiveSetting.BZ2:
+            cs, cn = archiver.archive_bz2(
+                src, dst, self.setting.workers, stream)
+        else:
+            return out
+        if cs[0] == 0:
+            out = (True, cs, cn)
+        else:
+            out = (False, cs, None)
+        return out
+
+    def get_name(self, src):
+        """."""
+        out = os.path.basename(os.path.normpath(src)) + self.get_extension()
+        return out
+
+    def get_extension(self):
+        """."""
+        if self.setting.algo == ArchiveSetting.BZ2:
+            out = '.tar.bz2'
+        else:
+            out = '.tar'
+        return out
+
+    def is_interrupted(self):
+        """."""
+        return self.interrupted is not None and self.interrupted.is_set()
+
+
+class CipherSetting:
+    """."""
+
+    XOR = 0
+    AES = 1
+
+    def __init__(self):
+        self.algo = None
+        self.password = None
+
+
+class CipherOperation:
+    """."""
+
+    def __init__(self, setting, interrupted=None):
+        self.setting = setting
+        self.interrupted = interrupted
+
+    def encrypt_file(self, src, dst):
+        """."""
+        copier = Copier(self.interrupted)
+        stream = StreamPipeline([self.make_stage()])
+        cs, cn = copier.copy_file_stream(src, dst, stream)
+        if cs[0] == 0:
+            out = (True, cs, cn)
+        else:
+            out = (False, cs, None)
+        return out
+
+    def encrypt_dir(self, src, dst):
+        """."""
+        archiver = Archiver(self.interrupted)
+        stream = StreamPipeline([self.make_stage()])
+        cs, cn = archiver.archive_tar(src, dst, stream)
+        if cs[0] == 0:
+            out = (True, cs, cn)
+        else:
+            out = (False, cs, None)
+        return out
+
+    def make_stage(self):
+        """."""
+        if self.setting.algo == CipherSetting.XOR:
+            out = XorCryptor(self.setting.password)
+        else:
+            out = AESCryptor(self.setting.password)
+        return out
+
+    def get_error(self):
+        """."""
+        if self.setting.algo != CipherSetting.XOR:
+            out = 'Error cipher: algorithm is not supported'
+        elif not self.setting.password:
+            out = 'Error cipher: password is not set'
+        else:
+            out = None
+        return out
+
+
+class Copier:
+    """."""
+
+    def __init__(self, interrupted=None):
+        self.interrupted = interrupted
+
+    def copy_file_error(self, src, dst, stream=None):
+        """."""
+        return self.copy_file_stream(src, dst, stream)
+
+    def copy_file_skip(self, src, dst, stream=None):
+        """."""
+        return self.copy_file_stream(src, dst, stream)
+
+    def copy_file_replace(self, src, dst, stream=None):
+        """."""
+        return self.copy_file_stream(src, dst, stream)
+
+    def copy_file_rotate(self, src, dst, count, stream=None):
+        """."""
+        rotator = Rotator()
+        try:
+            rotator.rotate(dst, count)
+            rotator.rotate(HashFile().get_path(src, dst), count)
+        except OSError as e:
+            msg = ('Error rotate: can\'t rotate: '
+                   + dst + ': ' + str(e.strerror))
+            return ((1, msg), 0)
+        return self.copy_file_stream(src, dst, stream)
+
+    def copy_file_stream(self, src, dst, stream=None):
+        """."""
+        engine = CopyEngine(self.interrupted)
+        try:
+            nbytes = engine.copy_file(src, dst, stream)
+        except OSError as e:
+            code = 1
+            msg = ('Error copy: can\'t copy: '
+                   + src + ' to ' + dst + ': ' + str(e.strerror))
+            nbytes = 0
+        else:
+            code = 0
+            msg = 'Success'
+        out = ((code, msg), nbytes)
+        return out
+
+    def copy_file_delta(self, src, dst, min_size, stream=None):
+        """."""
+        try:
+            srcsize = os.path.getsize(src)
+            is_delta = srcsize >= min_size and os.path.isfile(dst)
+            if stream is not None and stream.is_transforming():
+                is_delta = False
+        except OSError:
+            is_delta = False
+        if not is_delta:
+            return self.copy_file_stream(src, dst, stream)
+        engine = DeltaEngine(self.interrupted)
+        try:
+            nbytes, nwritten = engine.copy_file(src, dst, stream)
+        except OSError as e:
+            msg = ('Error delta: can\'t copy: '
+                   + src + ' to ' + dst + ': ' + str(e.strerror))
+            return ((1, msg), 0)
+        if stream is not None:
+            stream.set_written(nwritten)
+        msg = 'Success: delta wrote {} of {} bytes'.format(nwritten, nbytes)
+        return ((0, msg), nbytes)
+
+    def link_file_previous(self, src, prev, dst):
+        """."""
+        linker = Linker()
+        try:
+            linker.link(prev, dst)
+            prevhash = HashFile().get_path(src, prev)
+            if os.path.exists(prevhash):
+                linker.link(prevhash, HashFile().get_path(src, dst))
+        except OSError as e:
+            msg = ('Error link: can\'t link: '
+                   + prev + ' to ' + dst + ': ' + str(e.strerror))
+            return (1, msg)
+        return (0, 'Linked')
+
+    def copy_files_rotate(self, src, dsts, count, stream=None):
+        """."""
+        rotator = Rotator()
+        results = {}
+        copy_dsts = []
+        for dst in dsts:
+            try:
+                rotator.rotate(dst, count)
+                rotator.rotate(HashFile().get_path(src, dst), count)
+            except OSError as e:
+                msg = ('Error rotate: can\'t rotate: '
+                       + dst + ': ' + str(e.strerror))
+                results[dst] = ((1, msg), 0)
+            else:
+                copy_dsts.append(dst)
+        for dst, result in zip(
+                copy_dsts, self.copy_files_stream(src, copy_dsts, stream)):
+            results[dst] = result
+        out = [results[dst] for dst in dsts]
+        return out
+
+    def copy_files_stream(self, src, dsts, stream=None):
+        """."""
+        engine = CopyEngine(self.interrupted)
+        out = []
+        try:
+            nbytes, errors = engine.copy_file_multi(src, dsts, stream)
+        except OSError as e:
+            nbytes = 0
+            errors = dict((dst, e) for dst in dsts)
+        for dst in dsts:
+            if dst in errors:
+                msg = ('Error copy: can\'t copy: ' + src + ' to ' + dst
+                       + ': ' + str(errors[dst].strerror))
+                out.append(((1, msg), 0))
+            else:
+                out.append(((0, 'Success'), nbytes))
+        return out
+
+
+class TreeCopier:
+    """."""
+
+    def __init__(self, file_command, workers, interrupted=None):
+        self.file_command = file_command
+        self.workers = workers
+        self.interrupted = interrupted
+        self.limit = workers * 4
+        self.totals = TreeTotals()
+
+    def copy_tree(self, src, dst):
+        """."""
+        begin = time.time()
+        executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        pending = set()
+        stack = [(src, dst)]
+        try:
+            self.totals.fingerprint = SourceFingerprint(os.stat(src))
+        except OSError as e:
+            self.totals.add_error(src, str(e.strerror))
+        try:
+            while stack and not self.is_interrupted():
+                srcdir, dstdir = stack.pop()
+                try:
+                    os.makedirs(dstdir, exist_ok=True)
+                    entries = os.scandir(srcdir)
+                except OSError as e:
+                    self.totals.add_error(srcdir, str(e.strerror))
+                    continue
+                with entries:
+                    for entry in entries:
+                        if self.is_interrupted():
+                            break
+                        path = os.path.join(dstdir, entry.name)
+                        self.add_fingerprint(entry)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, path))
+                        elif entry.is_file(follow_symlinks=False):
+                            if len(pending) >= self.limit:
+                                pending = self.collect(pending)
+                            pending.add(executor.submit(
+                                self.file_command, entry.path, path))
+                        elif entry.is_symlink():
+                            self.copy_link(entry.path, path)
+                        else:
+                            self.totals.add_error(
+                                entry.path, 'unsupported file type')
+            while pending and not self.is_interrupted():
+                pending = self.collect(pending)
+        except KeyboardInterrupt:
+            self.totals.interrupted = True
+            if self.interrupted is not None:
+                self.interrupted.set()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        if self.is_interrupted():
+            self.totals.interrupted = True
+        self.totals.elapsed = time.time() - begin
+        return self.totals
+
+    def is_interrupted(self):
+        """."""
+        return self.interrupted is not None and self.interrupted.is_set()
+
+    def copy_link(self, src, dst):
+        """."""
+        try:
+            target = os.readlink(src)
+            if os.path.islink(dst) or os.path.isfile(dst):
+                os.unlink(dst)
+            os.symlink(target, dst)
+        except OSError as e:
+            self.totals.add_error(src, str(e.strerror))
+            return
+        self.totals.files += 1
+
+    def add_fingerprint(self, entry):
+        """."""
+        if self.totals.fingerprint is None:
+            return
+        try:
+            self.totals.fingerprint.add(entry.stat(follow_symlinks=False))
+        except OSError:
+            self.totals.fingerprint = None
+
+    def collect(self, pending):
+        """."""
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except OSError as e:
+                self.totals.add_error(e.filename, str(e.strerror))
+                continue
+            self.totals.phases.add_phases(result.phases)
+            if result.flags & CommandResult.F_FAIL:
+                self.totals.add_error(None, result.status[1])
+            elif result.flags & CommandResult.F_OK:
+                self.totals.files += 1
+                self.totals.nbytes += result.nbytes
+                self.totals.nwritten += result.nwritten
+                self.totals.add_stages(result.stages)
+            else:
+                self.totals.skipped += 1
+        return pending
+
+
+class PhaseTimer:
+    """."""
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+
+    def start(self):
+        """."""
+        return time.perf_counter()
+
+    def stop(self, name, begin, nbytes=0):
+        """."""
+        self.add(name, nbytes, time.perf_counter() - begin)
+
+    def add(self, name, nbytes, elapsed):
+        """."""
+        total = self.phases.setdefault(name, [0, 0.0])
+        total[0] += nbytes
+        total[1] += elapsed
+
+    def add_phases(self, phases):
+        """."""
+        for name, nbytes, elapsed in phases:
+            self.add(name, nbytes, elapsed)
+
+    def get_phases(self):
+        """."""
+        out = [(name, nbytes, elapsed)
+               for name, (nbytes, elapsed) in self.phases.items()]
+        return out
+
+
+class TreeTotals:
+    """."""
+
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.failed = 0
+        self.nbytes = 0
+        self.nwritten = 0
+        self.elapsed = 0.0
+        self.interrupted = False
+        self.first_error = None
+        self.stages = collections.OrderedDict()
+        self.phases = PhaseTimer()
+        self.fingerprint = None
+
+    def add_stages(self, stages):
+        """."""
+        for name, nbytes, elapsed in stages:
+            total = self.stages.setdefault(name, [0, 0.0])
+            total[0] += nbytes
+            total[1] += elapsed
+
+    def get_stages(self):
+        """."""
+        out = [(name, nbytes, elapsed)
+               for name, (nbytes, elapsed) in self.stages.items()]
+        return out
+
+    def add_error(self, path, message):
+        """."""
+        self.failed += 1
+        if self.first_error is None:
+            if path is not None:
+                message = path + ': ' + message
+            self.first_error = message
+
+    def get_summary(self):
+        """."""
+        fmt = '{} files, {} skipped, {} failed, {} bytes in {:.2f} s'
+        out = fmt.format(self.files, self.skipped, self.failed,
+                         self.nbytes, self.elapsed)
+        return out
+
+
+class Linker:
+    """."""
+
+    def link(self, src, dst):
+        """."""
+        if os.path.lexists(dst):
+            if os.path.samefile(src, dst):
+                return
+            tmpname = dst + '.link'
+            if os.path.lexists(tmpname):
+                os.remove(tmpname)
+            os.link(src, tmpname)
+            os.replace(tmpname, dst)
+        else:
+            os.link(src, dst)
+
+
+class Rotator:
+    """."""
+
+    def rotate(self, path, count):
+        """."""
+        if not os.path.lexists(path):
+            return
+        for i in range(count - 1, 0, -1):
+            old = self.get_generation(path, i)
+            if os.path.lexists(old):
+                os.rename(old, self.get_generation(path, i + 1))
+        os.rename(path, self.get_generation(path, 1))
+
+    def get_generation(self, path, number):
+        """."""
+        return '{}.{}'.format(path, number)
+
+
+class HashFile:
     """."""
 
-    def build_copy(self, options):
+    def get_path(self, src, dst):
         """."""
-        setting = CopySetting()
-        setting.mode = CopySetting.ERROR
-        out = CopyOperation(setting)
+        out = os.path.join(
+            os.path.dirname(dst),
+            os.path.basename(src) + '.hash')
         return out
 
-    def build_hash(self, options):
+
+class FileComparer:
+    """."""
+
+    def is_same(self, src, dst, hash_operation, touch=True):
         """."""
-        opt = [i for i in options if i.name == 'hash']
-        if opt:
-            setting = HashSetting()
-            algo = opt[0].params['algo']
-            if algo == 'md5':
-                setting.algo = HashSetting.MD5
-            elif algo == 'sha256':
-                setting.algo = HashSetting.SHA256
-            out = HashOperation(setting)
-        else:
-            out = None
-        return out
+        try:
+            srcstat = os.stat(src)
+            dststat = os.stat(dst)
+        except OSError:
+            return False
+        if srcstat.st_size != dststat.st_size:
+            return False
+        if srcstat.st_mtime_ns == dststat.st_mtime_ns:
+            return True
+        hb, hs, ho = hash_operation.hash_file(src)
+        if not hb:
+            return False
+        same = self.same_hashfile(src, dst, ho)
+        if same is None:
+            db, ds, do = hash_operation.hash_file(dst)
+            same = db and do == ho
+        if same and touch:
+            try:
+                os.utime(dst, ns=(dststat.st_atime_ns, srcstat.st_mtime_ns))
+            except OSError:
+                pass
+        return same
+
+    def same_hashfile(self, src, dst, hashtext):
+        """."""
+        hashfile = HashFile().get_path(src, dst)
+        try:
+            with open(hashfile, encoding='utf-8') as fin:
+                text = fin.read().strip()
+        except OSError:
+            return None
+        if len(text) != len(hashtext):
+            return None
+        return text == hashtext
+
+
+class CopyEngine:
+    """."""
 
-    def build_archive(self, options):
+    BUFFER_SIZE = 256 * 1024
+    CHUNK_MIN = 8 * 1024 * 1024
+    CHUNK_MAX = 64 * 1024 * 1024
+    FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                       errno.EOPNOTSUPP, errno.EBADF, errno.ETXTBSY,
+                       errno.EPERM)
+
+    def __init__(self, interrupted=None):
+        self.interrupted = interrupted
+
+    def copy_file(self, src, dst, stream=None):
         """."""
-        ArchiveOperation(ArchiveSetting())
-        out = None
-        return out
+        tmp = self.get_temp(dst)
+        try:
+            nbytes, srcstat = self.copy_file_temp(src, tmp, stream)
+            os.chmod(tmp, stat.S_IMODE(srcstat.st_mode))
+            os.utime(tmp, ns=(srcstat.st_atime_ns, srcstat.st_mtime_ns))
+            os.replace(tmp, dst)
+        except BaseException:
+            self.remove_temp(tmp)
+            raise
+        return nbytes
+
+    def copy_file_temp(self, src, tmp, stream=None):
+        """."""
+        with open(src, 'rb', buffering=0) as fin, open(tmp, 'wb') as fout:
+            infd, outfd = fin.fileno(), fout.fileno()
+            srcstat = os.fstat(infd)
+            chunk = min(max(srcstat.st_size, self.CHUNK_MIN), self.CHUNK_MAX)
+            nbytes = None
+            if stream is not None and not stream.is_empty():
+                nbytes = self.copy_buffered(fin, fout, stream)
+            if nbytes is None and hasattr(os, 'copy_file_range'):
+                nbytes = self.copy_file_range(infd, outfd, chunk)
+            if nbytes is None and hasattr(os, 'sendfile'):
+                nbytes = self.copy_sendfile(infd, outfd, chunk)
+            if nbytes is None:
+                nbytes = self.copy_buffered(fin, fout, stream)
+            elif stream is not None and stream.is_empty():
+                stream.add_counts(nbytes, nbytes)
+        return (nbytes, srcstat)
+
+    def copy_file_multi(self, src, dsts, stream=None):
+        """."""
+        errors = {}
+        fouts = {}
+        try:
+            with open(src, 'rb', buffering=0) as fin:
+                srcstat = os.fstat(fin.fileno())
+                for dst in dsts:
+                    try:
+                        fouts[dst] = open(self.get_temp(dst), 'wb')
+                    except OSError as e:
+                        errors[dst] = e
+                try:
+                    nbytes = self.copy_buffered_multi(
+                        fin, fouts, errors, stream)
+                finally:
+                    for dst, fout in fouts.items():
+                        try:
+                            fout.close()
+                        except OSError as e:
+                            errors.setdefault(dst, e)
+            for dst in fouts:
+                if dst not in errors:
+                    self.finish_temp(dst, srcstat, errors)
+        finally:
+            for dst in fouts:
+                self.remove_temp(self.get_temp(dst))
+        return (nbytes, errors)
+
+    def finish_temp(self, dst, srcstat, errors):
+        """."""
+        tmp = self.get_temp(dst)
+        try:
+            os.chmod(tmp, stat.S_IMODE(srcstat.st_mode))
+            os.utime(tmp, ns=(srcstat.st_atime_ns, srcstat.st_mtime_ns))
+            os.replace(tmp, dst)
+        except OSError as e:
+            errors[dst] = e
+
+    def get_temp(self, dst):
+        """."""
+        head, tail = os.path.split(dst)
+        return os.path.join(head, '.' + tail + '.part')
 
-    def build_cipher(self, options):
+    def remove_temp(self, tmp):
         """."""
-        CipherOperation(CipherSetting())
-        out = None
-        return out
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+    def copy_buffered_multi(self, fin, fouts, errors, stream=None):
+        """."""
+        buf = bytearray(self.BUFFER_SIZE)
+        view = memoryview(buf)
+        nbytes = 0
+        while True:
+            self.check_interrupted()
+            n = fin.readinto(buf)
+            if not n:
+                break
+            chunk = view[:n]
+            if stream is not None:
+                chunk = stream.process(chunk)
+            self.write_multi(fouts, errors, chunk)
+            nbytes += n
+        if stream is not None:
+            self.write_multi(fouts, errors, stream.flush())
+        return nbytes
+
+    def write_multi(self, fouts, errors, chunk):
+        """."""
+        for dst, fout in fouts.items():
+            if dst in errors:
+                continue
+            try:
+                fout.write(chunk)
+            except OSError as e:
+                errors[dst] = e
+
+    def copy_file_range(self, infd, outfd, chunk):
+        """."""
+        offset = 0
+        while True:
+            self.check_interrupted()
+            try:
+                sent = os.copy_file_range(infd, outfd, chunk)
+            except OSError as e:
+                if offset == 0 and e.errno in self.FALLBACK_ERRORS:
+                    return None
+                raise
+            if sent == 0:
+                break
+            offset += sent
+        if offset == 0:
+            return None
+        return offset
 
+    def copy_sendfile(self, infd, outfd, chunk):
+        """."""
+        offset = 0
+        while True:
+            self.check_interrupted()
+            try:
+                sent = os.sendfile(outfd, infd, offset, chunk)
+            except OSError as e:
+                if offset == 0 and e.errno in self.FALLBACK_ERRORS:
+                    return None
+                raise
+            if sent == 0:
+                break
+            offset += sent
+        if offset == 0:
+            return None
+        return offset
 
-class ContextCommands:
+    def copy_buffered(self, fin, fout, stream=None):
+        """."""
+        buf = bytearray(self.BUFFER_SIZE)
+        view = memoryview(buf)
+        nbytes = 0
+        while True:
+            self.check_interrupted()
+            n = fin.readinto(buf)
+            if not n:
+                break
+            chunk = view[:n]
+            if stream is not None:
+                chunk = stream.process(chunk)
+            fout.write(chunk)
+            nbytes += n
+        if stream is not None:
+            fout.write(stream.flush())
+        return nbytes
+
+    def check_interrupted(self):
+        """."""
+        if self.interrupted is not None and self.interrupted.is_set():
+            raise InterruptedError(errno.EINTR, 'Interrupted')
+
+
+class DeltaEngine:
     """."""
 
-    def __init__(self, copy_operation, hash_operation,
-                 archive_operation, cipher_operation):
-        self.copy_operation = copy_operation
-        self.hash_operation = hash_operation
-        self.archive_operation = archive_operation
-        self.cipher_operation = cipher_operation
+    BLOCK_SIZE = 64 * 1024
+    PAGE_SIZE = 4096
+    ADLER_MOD = 65521
+    MISS_LIMIT = 4
 
-    def file_to_file(self, src, dst):
-        """."""
-        out = CommandResult()
-        f_hasherror = False
+    def __init__(self, interrupted=None):
+        self.interrupted = interrupted
 
-        cb, cs, co = self.copy_operation.copy_file(src, dst)
-        if cb:
-            out.flags |= CommandResult.F_OK
-            out.status = cs
-        else:
-            out.flags |= CommandResult.F_FAIL
-            out.status = cs
-        if cb:
-            if self.hash_operation is not None:
-                hashfile = src + '.hash'
-                with open(hashfile, 'w', encoding='utf-8') as hashfout:
-                    hb, hs, ho = self.hash_operation.hash_file(src)
-                    if hb:
-                        hashtext = ho
-                        print(hashtext, file=hashfout)
-                        f_hasherror = False
-                    else:
-                        f_hasherror = True
-                shutil.move(
-                    hashfile,
-                    os.path.join(
-                        os.path.dirname(dst),
-                        os.path.basename(hashfile)))
-            if f_hasherror:
-                out.flags |= CommandResult.F_FAIL
-                out.status = hs
+    def copy_file(self, src, dst, stream=None):
+        """."""
+        dstmode = stat.S_IMODE(os.stat(dst).st_mode)
+        if not dstmode & stat.S_IWUSR:
+            os.chmod(dst, dstmode | stat.S_IWUSR)
+        try:
+            with open(dst, 'r+b', buffering=0) as fdst:
+                dstsize = os.fstat(fdst.fileno()).st_size
+                strongs, weaks = self.make_signatures(fdst)
+                with open(src, 'rb', buffering=0) as fsrc:
+                    srcstat = os.fstat(fsrc.fileno())
+                    window = DeltaWindow(fsrc, stream)
+                    nwritten = self.apply(
+                        window, fdst.fileno(), dstsize, strongs, weaks)
+                fdst.truncate(window.end)
+        except BaseException:
+            self.restore_mode(dst, dstmode)
+            raise
+        os.chmod(dst, stat.S_IMODE(srcstat.st_mode))
+        os.utime(dst, ns=(srcstat.st_atime_ns, srcstat.st_mtime_ns))
+        return (window.end, nwritten)
+
+    def restore_mode(self, dst, mode):
+        """."""
+        try:
+            os.chmod(dst, mode)
+        except OSError:
+            pass
 
-        return out
+    def make_signatures(self, fdst):
+        """."""
+        strongs = []
+        weaks = {}
+        offset = 0
+        while True:
+            block = os.pread(fdst.fileno(), self.BLOCK_SIZE, offset)
+            if not block:
+                break
+            if len(block) == self.BLOCK_SIZE:
+                weak = zlib.adler32(block)
+                weaks.setdefault(weak, []).append(len(strongs))
+            strongs.append(hashlib.md5(block).digest())
+            offset += len(block)
+        return (strongs, weaks)
+
+    def apply(self, window, dstfd, dstsize, strongs, weaks):
+        """."""
+        size = self.BLOCK_SIZE
+        pos = lit = nwritten = 0
+        expect = 0
+        misses = 0
+        while True:
+            self.check_interrupted()
+            block = window.get(pos, pos + size)
+            if not block:
+                break
+            j = self.match_expected(block, pos, expect, dstsize, strongs)
+            if j is None:
+                if self.is_searching(misses):
+                    k, j = self.search(window, pos, weaks, strongs)
+                if j is None:
+                    misses += 1
+                    pos += len(block)
+                    nwritten += self.write_literal(window, dstfd, lit, pos)
+                    lit = pos
+                    window.drop(lit)
+                    expect = None
+                    continue
+                pos = k
+            misses = 0
+            nwritten += self.write_literal(window, dstfd, lit, pos)
+            length = min(size, dstsize - j * size)
+            if j * size != pos:
+                data = os.pread(dstfd, length, j * size)
+                self.write_at(dstfd, pos, data)
+                nwritten += length
+            pos += length
+            lit = pos
+            window.drop(lit)
+            expect = j + 1
+        return nwritten
+
+    def check_interrupted(self):
+        """."""
+        if self.interrupted is not None and self.interrupted.is_set():
+            raise InterruptedError(errno.EINTR, 'Interrupted')
 
-    def file_to_dir(self, src, dst):
+    def is_searching(self, misses):
         """."""
-        out = CommandResult()
-        out.flags |= CommandResult.F_OK
-        out.status = (0, 'Success')
-        return out
+        if misses < self.MISS_LIMIT:
+            return True
+        return misses & (misses - 1) == 0
 
-    def dir_to_dir(self, src, dst):
+    def match_expected(self, block, pos, expect, dstsize, strongs):
         """."""
-        out = CommandResult()
-        out.flags |= CommandResult.F_OK
-        out.status = (0, 'Success')
-        return out
+        size = self.BLOCK_SIZE
+        candidates = []
+        if expect is not None:
+            candidates.append(expect)
+        if pos % size == 0 and pos // size != expect:
+            candidates.append(pos // size)
+        for j in candidates:
+            if j >= len(strongs) or j * size < pos:
+                continue
+            length = min(size, dstsize - j * size)
+            if len(block) < length:
+                continue
+            if hashlib.md5(block[:length]).digest() == strongs[j]:
+                return j
+        return None
+
+    def search(self, window, pos, weaks, strongs):
+        """."""
+        size = self.BLOCK_SIZE
+        mod = self.ADLER_MOD
+        data = window.get(pos, pos + 2 * size)
+        if len(data) < size or not weaks:
+            return (None, None)
+        weak = zlib.adler32(data[:size])
+        a, b = weak & 0xffff, weak >> 16
+        for k in range(min(size, len(data) - size + 1)):
+            if k > 0:
+                x_out, x_in = data[k - 1], data[k + size - 1]
+                a = (a - x_out + x_in) % mod
+                b = (b - size * x_out + a - 1) % mod
+                weak = (b << 16) | a
+            if weak in weaks:
+                strong = hashlib.md5(data[k:k + size]).digest()
+                for j in weaks[weak]:
+                    if strongs[j] == strong and j * size >= pos + k:
+                        return (pos + k, j)
+        return (None, None)
+
+    def write_literal(self, window, dstfd, begin, end):
+        """."""
+        nwritten = 0
+        page = self.PAGE_SIZE
+        data = window.get(begin, end)
+        old = os.pread(dstfd, len(data), begin)
+        for i in range(0, len(data), page):
+            chunk = data[i:i + page]
+            if chunk != old[i:i + page]:
+                self.write_at(dstfd, begin + i, chunk)
+                nwritten += len(chunk)
+        return nwritten
+
+    def write_at(self, fd, offset, data):
+        """."""
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
 
 
-class CommandResult:
+class DeltaWindow:
     """."""
 
-    F_OK = 0x1
-    F_FAIL = 0x2
-    F_SKIP = 0x4
-    F_INTER = 0x8
+    READ_SIZE = 1024 * 1024
 
-    def __init__(self):
-        self.flags = 0
-        self.status = None
+    def __init__(self, fin, stream=None):
+        self.fin = fin
+        self.stream = stream
+        self.buf = bytearray()
+        self.start = 0
+        self.end = 0
+        self.eof = False
 
+    def get(self, begin, end):
+        """."""
+        while not self.eof and self.end < end:
+            chunk = self.fin.read(self.READ_SIZE)
+            if not chunk:
+                self.eof = True
+                break
+            if self.stream is not None:
+                self.stream.process(chunk)
+            self.buf += chunk
+            self.end += len(chunk)
+        return bytes(self.buf[begin - self.start:end - self.start])
 
-class CopySetting:
+    def drop(self, before):
+        """."""
+        n = before - self.start
+        if n > 0:
+            del self.buf[:n]
+            self.start = before
+
+
+class Hasher:
     """."""
 
-    ERROR = 0
-    SKIP = 1
-    REPLACE = 2
-    ROTATE = 3
+    BUFFER_SIZE = 256 * 1024
 
-    def __init__(self):
-        self.mode = None
+    def __init__(self, interrupted=None):
+        self.interrupted = interrupted
 
+    def hash_md5_file(self, path):
+        """."""
+        return self.hash_digest_file(path, hashlib.md5())
 
-class CopyOperation:
-    """."""
+    def hash_sha1_file(self, path):
+        """."""
+        return self.hash_digest_file(path, hashlib.sha1())
 
-    def __init__(self, setting):
-        self.setting = setting
+    def hash_sha256_file(self, path):
+        """."""
+        return self.hash_digest_file(path, hashlib.sha256())
 
-    def copy_file(self, src, dst):
+    def hash_blake2b_file(self, path):
         """."""
-        copier = Copier()
-        out = (False, None, None)
-        if self.setting.mode == CopySetting.ERROR:
-            cs = copier.copy_file_error(src, dst)
-            if cs[0] == 0:
-                out = (True, cs, None)
-            else:
-                out = (False, cs, None)
-        return out
+        return self.hash_digest_file(path, hashlib.blake2b())
+
+    def hash_blake2s_file(self, path):
+        """."""
+        return self.hash_digest_file(path, hashlib.blake2s())
 
-    def copy_dir(self, src, dst):
+    def hash_digest_file(self, path, digest):
         """."""
-        return (True, (0, 'Success'), None)
+        try:
+            with open(path, 'rb', buffering=0) as fin:
+                self.update_buffered(fin, digest)
+        except OSError as e:
+            code = 1
+            msg = 'Error hash: can\'t hash: ' + path + ': ' + str(e.strerror)
+            text = None
+        else:
+            code = 0
+            msg = 'Success'
+            text = digest.hexdigest()
+        return ((code, msg), text)
+
+    def update_buffered(self, fin, digest):
+        """."""
+        buf = bytearray(self.BUFFER_SIZE)
+        view = memoryview(buf)
+        while True:
+            self.check_interrupted()
+            n = fin.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
 
+    def check_interrupted(self):
+        """."""
+        if self.interrupted is not None and self.interrupted.is_set():
+            raise InterruptedError(errno.EINTR, 'Interrupted')
 
-class HashSetting:
+
+class Archiver:
     """."""
 
-    MD5 = 0
-    SHA256 = 1
+    BUFFER_SIZE = 256 * 1024
 
-    def __init__(self):
-        self.algo = None
+    def __init__(self, interrupted=None, process_pool=None):
+        self.interrupted = interrupted
+        self.process_pool = process_pool
 
+    def archive_tar(self, src, dst, stream):
+        """."""
+        return self.archive_stream(src, dst, stream)
 
-class HashOperation:
-    """."""
+    def archive_bz2(self, src, dst, workers, stream):
+        """."""
+        executor = None
+        if workers > 1 and self.process_pool is not None:
+            executor = self.process_pool.get_executor(workers)
+        stream.add_first(Bz2Stage(workers, executor))
+        return self.archive_stream(src, dst, stream)
 
-    def __init__(self, setting):
-        self.setting = setting
+    def archive_stream(self, src, dst, stream):
+        """."""
+        tmp = self.get_temp(dst)
+        try:
+            with open(tmp, 'wb') as fout:
+                writer = StreamWriter(fout, stream)
+                self.write_tar(writer, src)
+                writer.finish()
+            if self.is_interrupted():
+                self.remove(tmp)
+                return ((1, 'Error tar: interrupted: ' + src), 0)
+            os.replace(tmp, dst)
+        except OSError as e:
+            self.remove(tmp)
+            msg = ('Error tar: can\'t archive: '
+                   + src + ' to ' + dst + ': ' + str(e.strerror))
+            return ((1, msg), 0)
+        except tarfile.TarError as e:
+            self.remove(tmp)
+            msg = ('Error tar: can\'t archive: '
+                   + src + ' to ' + dst + ': ' + str(e))
+            return ((1, msg), 0)
+        except concurrent.futures.process.BrokenProcessPool as e:
+            self.remove(tmp)
+            msg = ('Error bz2: can\'t compress: '
+                   + src + ' to ' + dst + ': ' + str(e))
+            return ((1, msg), 0)
+        except BaseException:
+            self.remove(tmp)
+            raise
+        finally:
+            stream.close()
+        return ((0, 'Success'), writer.nbytes)
+
+    def get_temp(self, dst):
+        """."""
+        head, tail = os.path.split(dst)
+        return os.path.join(head, '.' + tail + '.part')
 
-    def hash_file(self, path):
+    def write_tar(self, fout, src):
         """."""
-        hasher = Hasher()
-        if self.setting.algo == HashSetting.MD5:
-            s, o = hasher.hash_md5_file(path)
-        elif self.setting.algo == HashSetting.SHA256:
-            s, o = hasher.hash_sha256_file(path)
-        if s[0] == 0:
-            out = (True, s, o)
-        else:
-            out = (False, s, None)
-        return out
+        with tarfile.open(fileobj=fout, mode='w|',
+                          copybufsize=self.BUFFER_SIZE) as tar:
+            self.add_tree(tar, src)
 
-    def hash_dir(self, path):
+    def add_tree(self, tar, src):
         """."""
-        return (True, (0, 'Success'), '')
+        tar.add(src, os.path.basename(os.path.normpath(src)),
+                recursive=False)
+        if os.path.islink(src) or not os.path.isdir(src):
+            return
+        base = os.path.dirname(os.path.normpath(src))
+        for top, dirs, files in os.walk(src):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                if self.is_interrupted():
+                    return
+                path = os.path.join(top, name)
+                tar.add(path, os.path.relpath(path, base), recursive=False)
+
+    def is_interrupted(self):
+        """."""
+        return self.interrupted is not None and self.interrupted.is_set()
 
+    def remove(self, path):
+        """."""
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
-class ArchiveSetting:
+
+class StreamPipeline:
     """."""
 
-    TAR = 0
-    BZ2 = 1
+    def __init__(self, stages=None):
+        self.stages = list(stages or [])
+        self.nread = 0
+        self.nwritten = 0
 
-    def __init__(self):
-        self.algo = None
+    def add_first(self, stage):
+        """."""
+        self.stages.insert(0, stage)
 
+    def is_empty(self):
+        """."""
+        return not self.stages
 
-class ArchiveOperation:
-    """."""
+    def is_transforming(self):
+        """."""
+        return any(stage.TRANSFORMS for stage in self.stages)
 
-    def __init__(self, setting):
-        self.setting = setting
+    def process(self, data):
+        """."""
+        self.nread += len(data)
+        out = self.process_from(0, data)
+        self.nwritten += len(out)
+        return out
 
-    def archive_file(self, src, dst):
+    def add_counts(self, nread, nwritten):
         """."""
-        return (True, (0, 'Success'), None)
+        self.nread += nread
+        self.nwritten += nwritten
 
-    def archive_dir(self, src, dst):
+    def set_written(self, nwritten):
         """."""
-        return (True, (0, 'Success'), None)
+        self.nwritten = nwritten
 
+    def process_from(self, index, data):
+        """."""
+        for stage in self.stages[index:]:
+            if not data:
+                break
+            begin = time.perf_counter()
+            stage.nbytes += len(data)
+            data = stage.process(data)
+            stage.elapsed += time.perf_counter() - begin
+        return data
 
-class CipherSetting:
-    """."""
+    def flush(self):
+        """."""
+        out = []
+        for i, stage in enumerate(self.stages):
+            begin = time.perf_counter()
+            data = stage.flush()
+            stage.elapsed += time.perf_counter() - begin
+            if data:
+                out.append(self.process_from(i + 1, data))
+        out = b''.join(out)
+        self.nwritten += len(out)
+        return out
 
-    XOR = 0
-    AES = 1
+    def close(self):
+        """."""
+        for stage in self.stages:
+            stage.close()
 
-    def __init__(self):
-        self.algo = None
-        self.password = None
+    def get_timings(self):
+        """."""
+        out = [(stage.name, stage.nbytes, stage.elapsed)
+               for stage in self.stages]
+        return out
 
 
-class CipherOperation:
+class StreamStage:
     """."""
 
-    def __init__(self, setting):
-        self.setting = setting
+    TRANSFORMS = True
 
-    def encrypt_file(self, src, dst):
+    def __init__(self, name):
+        self.name = name
+        self.nbytes = 0
+        self.elapsed = 0.0
+
+    def process(self, data):
         """."""
-        return (True, (0, 'Success'), None)
+        return data
 
-    def encrypt_dir(self, src, dst):
+    def flush(self):
+        """."""
+        return b''
+
+    def close(self):
         """."""
-        return (True, (0, 'Success'), None)
+        pass
 
 
-class Copier:
+class HashStage(StreamStage):
     """."""
 
-    def copy_file_error(self, src, dst):
+    TRANSFORMS = False
+
+    def __init__(self, digest):
+        StreamStage.__init__(self, digest.name)
+        self.digest = digest
+
+    def process(self, data):
         """."""
-        p = subprocess.Popen(['cp', src, dst])
-        p.wait()
-        code = p.returncode
-        if code == 0:
-            msg = 'Success'
-        else:
-            msg = ('Error cmd: cp: can\'t copy: '
-                   + src + ' to ' + dst)
-        out = (code, msg)
-        return out
+        self.digest.update(data)
+        return data
 
-    def copy_file_skip(self, src, dst):
+
+class Bz2Stage(StreamStage):
+    """."""
+
+    BLOCK_SIZE = 900 * 1024
+    LEVEL = 9
+
+    def __init__(self, workers, executor=None):
+        StreamStage.__init__(self, 'bz2')
+        self.limit = workers * 2
+        self.buf = bytearray()
+        self.pending = collections.deque()
+        self.executor = executor
+
+    def process(self, data):
+        """."""
+        out = []
+        self.buf += data
+        while len(self.buf) >= self.BLOCK_SIZE:
+            block = bytes(self.buf[:self.BLOCK_SIZE])
+            del self.buf[:self.BLOCK_SIZE]
+            out.extend(self.submit(block))
+        return b''.join(out)
+
+    def submit(self, block):
         """."""
-        return (0, 'Success')
+        if self.executor is None:
+            return [bz2.compress(block, self.LEVEL)]
+        out = []
+        if len(self.pending) >= self.limit:
+            out.append(self.pending.popleft().result())
+        self.pending.append(
+            self.executor.submit(bz2.compress, block, self.LEVEL))
+        return out
 
-    def copy_file_replace(self, src, dst):
+    def flush(self):
         """."""
-        return (0, 'Success')
+        out = []
+        if self.buf:
+            out.extend(self.submit(bytes(self.buf)))
+            self.buf.clear()
+        while self.pending:
+            out.append(self.pending.popleft().result())
+        return b''.join(out)
 
-    def copy_file_rotate(self, src, dst):
+    def close(self):
         """."""
-        return (0, 'Success')
+        while self.pending:
+            self.pending.popleft().cancel()
 
 
-class Hasher:
+class ProcessPool:
     """."""
 
-    def hash_md5_file(self, path):
+    def __init__(self):
+        self.executors = {}
+        self.lock = threading.Lock()
+
+    def get_executor(self, workers):
         """."""
-        p = subprocess.Popen(['md5sum', path], stdout=subprocess.PIPE)
-        p.wait()
-        code = p.returncode
-        if code == 0:
-            msg = 'Success'
-        else:
-            msg = 'Error'
-        text = p.stdout.read().decode('utf-8').split()[0]
-        return ((code, msg), text)
+        with self.lock:
+            out = self.executors.get(workers)
+            if out is None:
+                out = concurrent.futures.ProcessPoolExecutor(
+                    workers,
+                    mp_context=self.get_context(),
+                    initializer=signal.signal,
+                    initargs=(signal.SIGINT, signal.SIG_IGN))
+                self.executors[workers] = out
+        return out
 
-    def hash_sha256_file(self, path):
+    def get_context(self):
         """."""
-        p = subprocess.Popen(['sha256sum', path], stdout=subprocess.PIPE)
-        p.wait()
-        code = p.returncode
-        if code == 0:
-            msg = 'Success'
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            out = multiprocessing.get_context('forkserver')
         else:
-            msg = 'Error'
-        text = p.stdout.read().decode('utf-8').split()[0]
-        return ((code, msg), text)
+            out = multiprocessing.get_context('spawn')
+        return out
+
+    def close(self):
+        """."""
+        with self.lock:
+            for executor in self.executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+            self.executors.clear()
 
 
-class Archiver:
+class StreamWriter:
     """."""
 
-    def archive_tar(self, src, dst):
+    def __init__(self, fout, stream):
+        self.fout = fout
+        self.stream = stream
+        self.nbytes = 0
+
+    def write(self, data):
         """."""
-        return (0, 'Success')
+        self.write_out(self.stream.process(data))
+        return len(data)
 
-    def archive_bz2(self, src, dst):
+    def finish(self):
         """."""
-        return (0, 'Success')
+        self.write_out(self.stream.flush())
+
+    def write_out(self, data):
+        """."""
+        if data:
+            self.fout.write(data)
+            self.nbytes += len(data)
 
 
-class XorCryptor:
+class XorCryptor(StreamStage):
     """."""
 
-    def encrypt_file(self, src, dst, password):
+    PAD_CACHE_SIZE = 64
+
+    def __init__(self, password):
+        StreamStage.__init__(self, 'xor')
+        self.key = password.encode('utf-8')
+        self.pad = b''
+        self.pad_numbers = {}
+        self.offset = 0
+
+    def process(self, data):
         """."""
-        return (0, 'Success')
+        size = len(data)
+        start = self.offset % len(self.key)
+        pad = memoryview(self.get_pad(start + size))[start:start + size]
+        self.offset += size
+        if numpy is not None:
+            out = numpy.bitwise_xor(
+                numpy.frombuffer(data, numpy.uint8),
+                numpy.frombuffer(pad, numpy.uint8)).tobytes()
+        else:
+            number = (int.from_bytes(data, 'little')
+                      ^ self.get_pad_number(start, size, pad))
+            out = number.to_bytes(size, 'little')
+        return out
+
+    def get_pad_number(self, start, size, pad):
+        """."""
+        key = (start, size)
+        if key not in self.pad_numbers:
+            if len(self.pad_numbers) >= self.PAD_CACHE_SIZE:
+                self.pad_numbers.clear()
+            self.pad_numbers[key] = int.from_bytes(pad, 'little')
+        return self.pad_numbers[key]
+
+    def get_pad(self, size):
+        """."""
+        if len(self.pad) < size:
+            self.pad = self.key * (size // len(self.key) + 1)
+        return self.pad
 
 
-class AESCryptor:
+class AESCryptor(StreamStage):
     """."""
 
-    def encrypt_file(self, src, dst, password):
-        """."""
-        return (0, 'Success')
+    def __init__(self, password):
+        StreamStage.__init__(self, 'aes')
+        self.password = password
 
 
 class TaskConverter:
@@ -988,12 +4169,17 @@ class TaskConverter:
         report.status = task.status
         report.begin = task.begin
         report.end = task.end
+        report.nbytes = task.nbytes
+        report.nwritten = task.nwritten
+        report.stages = task.stages
+        report.phases = task.phases
         report.source = task.source
         report.destination = task.destination
         report.options = ', '.join(
             '{}=({})'.format(
                 i.name, ','.join(
-                    '{}:{}'.format(k, v) for k, v in i.params.items()))
+                    '{}:{}'.format(k, '***' if k == 'password' else v)
+                    for k, v in i.params.items()))
             for i in task.options)
         return report
 
@@ -1001,6 +4187,9 @@ class TaskConverter:
 class Report:
     """."""
 
+    __slots__ = ('name', 'status', 'begin', 'end', 'source', 'destination',
+                 'options', 'nbytes', 'nwritten', 'stages', 'phases')
+
     def __init__(self):
         self.name = None
         self.status = ()
@@ -1009,6 +4198,10 @@ class Report:
         self.source = None
         self.destination = None
         self.options = None
+        self.nbytes = 0
+        self.nwritten = 0
+        self.stages = []
+        self.phases = []
 
 
 class ReportConverter:
@@ -1016,7 +4209,7 @@ class ReportConverter:
 
     def to_console_message(self, report):
         """."""
-        out = '{} {} {} {} {} {} ret={} {}'.format(
+        out = '{} {} {} {} {} {} ret={} {} {}{}'.format(
             report.name,
             time.strftime('%H:%M:%S', time.localtime(report.begin)),
             time.strftime('%H:%M:%S', time.localtime(report.end)),
@@ -1024,7 +4217,64 @@ class ReportConverter:
             report.destination,
             report.options,
             report.status[0],
-            report.status[1])
+            report.status[1],
+            self.to_throughput(report),
+            self.to_stages(report))
+        return out
+
+    def to_throughput(self, report):
+        """."""
+        speed = self.to_speed(report.nbytes, report.end - report.begin)
+        out = '{} bytes {:.2f} MB/s'.format(report.nbytes, speed)
+        return out
+
+    def to_stages(self, report):
+        """."""
+        if not report.stages:
+            return ''
+        out = ' [{}]'.format(', '.join(
+            '{} {:.3f} s'.format(name, elapsed)
+            for name, nbytes, elapsed in report.stages))
+        return out
+
+    def to_json_message(self, report, result):
+        """."""
+        elapsed = report.end - report.begin
+        record = collections.OrderedDict((
+            ('name', report.name),
+            ('source', report.source),
+            ('destination', report.destination),
+            ('options', report.options),
+            ('result', result),
+            ('status', report.status[0]),
+            ('message', report.status[1]),
+            ('begin', round(report.begin, 6)),
+            ('end', round(report.end, 6)),
+            ('elapsed', round(elapsed, 6)),
+            ('bytes_read', report.nbytes),
+            ('bytes_written', report.nwritten),
+            ('mb_per_s', round(self.to_speed(report.nbytes, elapsed), 2)),
+            ('stages', self.to_json_timings(report.stages)),
+            ('phases', self.to_json_timings(report.phases))))
+        out = json.dumps(record)
+        return out
+
+    def to_json_timings(self, timings):
+        """."""
+        out = [collections.OrderedDict((
+                   ('name', name),
+                   ('bytes', nbytes),
+                   ('seconds', round(seconds, 6)),
+                   ('mb_per_s', round(self.to_speed(nbytes, seconds), 2))))
+               for name, nbytes, seconds in timings]
+        return out
+
+    def to_speed(self, nbytes, elapsed):
+        """."""
+        if elapsed > 0:
+            out = nbytes / elapsed / (1024 * 1024)
+        else:
+            out = 0.0
         return out
 
     def to_log_message(self, report):